@@ -4,11 +4,29 @@
 # https://wiki.openstreetmap.org/wiki/OSM_XML
 # Typical invocation:
 # pv ../planet-latest.osm.bz2 | bzcat | ../disassemble-osm.py | split -C1000M -d -a 4 --additional-suffix='.xml' --filter='gzip > $FILE.gz' - osm-planet-
+# Parallel (reads the file itself, .osm or .osm.bz2; same output, same order):
+# ../disassemble-osm.py --jobs 8 ../planet-latest.osm.bz2 | split -C1000M -d -a 4 --additional-suffix='.xml' --filter='gzip > $FILE.gz' - osm-planet-
 
 
+import io
+import os
+import bz2
 import sys
+import mmap
+import argparse
+import multiprocessing
+from collections import deque
 from lxml import etree
 
+# decompressed bytes per parse task
+CHUNK_SIZE = 16 * 1024 * 1024
+# compressed bytes per bz2 decompression task
+BZ2_TASK_SIZE = 4 * 1024 * 1024
+# start of a bz2 stream: 'BZh' + block size digit + block magic (pi)
+BZ2_STREAM_MAGIC = (b'BZh', b'1AY&SY')
+# top-level elements of an OSM file
+RECORD_STARTS = (b'<node', b'<way', b'<relation', b'<changeset', b'<bounds')
+
 
 def main(instream, outstream):
     # based on https://stackoverflow.com/a/35309644
@@ -37,4 +55,152 @@ def main(instream, outstream):
                 del elem.getparent()[0]
 
 
-main(sys.stdin.buffer, sys.stdout.buffer)
+def disassemble_chunk(data):
+    """
+    Disassemble a run of complete top-level records (no <osm> wrapper)
+    """
+    out = io.BytesIO()
+    main(io.BytesIO(b'<osm>' + data + b'</osm>'), out)
+    return out.getvalue()
+
+
+def bz2_stream_offsets(path, task_size=None):
+    """
+    Offsets of bz2 streams roughly task_size apart, plus the file size.
+    Multistream files (pbzip2 / lbzip2, the planet files) start a new
+    byte-aligned stream every block, so they can be split there.
+    """
+    task_size = task_size or BZ2_TASK_SIZE
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        target = task_size
+        while target < size:
+            found = data.find(BZ2_STREAM_MAGIC[0], target)
+            while found != -1 and data[found + 4:found + 10] != BZ2_STREAM_MAGIC[1]:
+                found = data.find(BZ2_STREAM_MAGIC[0], found + 1)
+            if found == -1:
+                break
+            offsets.append(found)
+            target = found + task_size
+    offsets.append(size)
+    return offsets
+
+
+def decompress_range(task):
+    """
+    Decompress the complete bz2 streams in [start, end) of a file
+    """
+    path, start, end = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    out = []
+    while data:
+        decompressor = bz2.BZ2Decompressor()
+        out.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise ValueError(f"{path}: bz2 stream at or after byte {start} is cut at byte {end}")
+        data = decompressor.unused_data
+    return b''.join(out)
+
+
+def ordered_map(pool, func, tasks, window):
+    """
+    pool.imap with at most window tasks in flight (bounds memory), results in order
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def read_blocks(path, pool, window):
+    """
+    Decompressed content of path in blocks, in order
+    """
+    if path.endswith('.bz2'):
+        offsets = bz2_stream_offsets(path)
+        if len(offsets) > 2:
+            tasks = ((path, start, end) for start, end in zip(offsets, offsets[1:]))
+            yield from ordered_map(pool, decompress_range, tasks, window)
+            return
+        # a single stream has no byte-aligned split points: decompress here, parse in parallel
+        opener = bz2.open
+    else:
+        opener = open
+
+    with opener(path, 'rb') as f:
+        while True:
+            block = f.read(CHUNK_SIZE)
+            if not block:
+                return
+            yield block
+
+
+def last_record_start(data):
+    """
+    Position of the last top-level record start in data, or -1
+    """
+    best = -1
+    for start in RECORD_STARTS:
+        pos = data.rfind(start)
+        while pos != -1 and data[pos + len(start):pos + len(start) + 1] not in (b' ', b'>', b'/', b'\t', b'\n', b'\r'):
+            pos = data.rfind(start, 0, pos)
+        best = max(best, pos)
+    return best
+
+
+def record_chunks(blocks):
+    """
+    Cut the decompressed blocks into chunks of complete records of about CHUNK_SIZE,
+    without the XML declaration, the <osm> start tag and the </osm> end tag
+    """
+    buffer = b''
+    header_done = False
+    for block in blocks:
+        buffer += block
+        if not header_done:
+            osm = buffer.find(b'<osm')
+            tag_end = buffer.find(b'>', osm) if osm != -1 else -1
+            if tag_end == -1:
+                continue
+            buffer = buffer[tag_end + 1:]
+            header_done = True
+        if len(buffer) < CHUNK_SIZE:
+            continue
+
+        cut = last_record_start(buffer)
+        if cut > 0:
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+
+    end = buffer.rfind(b'</osm>')
+    if end != -1:
+        buffer = buffer[:end]
+    if buffer.strip():
+        yield buffer
+
+
+def main_parallel(path, outstream, jobs):
+    with multiprocessing.Pool(jobs) as pool:
+        window = 2 * jobs
+        chunks = record_chunks(read_blocks(path, pool, window))
+        for xml in ordered_map(pool, disassemble_chunk, chunks, window):
+            outstream.write(xml)
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Write every top-level OSM XML element on its own line')
+    args.add_argument('input', nargs='?', help='.osm or .osm.bz2 file (default: stdin, single process)')
+    args.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes when an input file is given')
+    args = args.parse_args()
+
+    if args.input is None:
+        main(sys.stdin.buffer, sys.stdout.buffer)
+    else:
+        main_parallel(args.input, sys.stdout.buffer, args.jobs)
@@ -2,6 +2,8 @@
 # Typical invocation:
 # spark-submit just-vancouver.py amenities amenities-vancouver
 # hdfs dfs -cat amenities-vancouver/* | gzip -d - | gzip -c > amenities-vancouver.json.gz
+# Without Spark (streams the input in chunks, from the repository root):
+# python3 -m core.amenity_stream amenities amenities-vancouver.json.gz
 
 import sys
 assert sys.version_info >= (3, 5) # make sure we have Python 3.5+
@@ -1,6 +1,8 @@
 # Extract Spark-style JSON from planet.osm data.
 # Typical invocation:
 # spark-submit osm-amenities.py /courses/datasets/openstreetmaps amenities
+# Without Spark, on all local cores (from the repository root):
+# python3 -m core.osm_extract 'osm-planet-*.xml.gz' amenities
 
 import sys
 assert sys.version_info >= (3, 5) # make sure we have Python 3.5+
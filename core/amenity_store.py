@@ -0,0 +1,172 @@
+# Description:
+#   Columnar binary store of the cleaned amenity data (Arrow IPC / Feather v2).
+#   The JSON lines are parsed and cleaned once; later runs memory-map the store.
+#   Tags are kept as a TagTable (see tag_table.py), returned next to the frame
+#   and stored as two dictionary encoded list columns sharing the same offsets.
+
+import os
+import json
+
+import numpy as np
+
+from core import data_cleaning as dc
+from core import tag_table as tt
+from core import amenity_stream as sm
+
+STORE_VERSION = 2
+
+# override the location with TOUR_AMENITY_CACHE
+STORE_DIR = os.environ.get(
+    'TOUR_AMENITY_CACHE',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'amenities'))
+
+def store_paths(json_path, store_dir=None):
+    """
+    (store file, metadata file) for the given amenity JSON file
+    """
+    base = os.path.join(store_dir or STORE_DIR, os.path.basename(json_path))
+    return base + '.arrow', base + '.json'
+
+def _source_stamp(json_path):
+    stat = os.stat(json_path)
+    return {'source': os.path.abspath(json_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def encode_tags(data):
+    """
+    Replace the 'tags' dict column by a TagTable (rows linked by 'tag_row') and add
+    the derived columns used by the scoring / filters:
+        tag_count, has_wikipedia, has_wikidata
+        @return (data, TagTable)
+    """
+    table = tt.TagTable.from_dicts(data['tags'])
+    data = tt.number_rows(data.drop(columns=['tags']))
+    return data.assign(
+        tag_count=table.counts().astype(np.int32),
+        has_wikipedia=table.has_key('wikipedia'),
+        has_wikidata=table.has_key('wikidata'),
+    ), table
+
+def read_json(json_path):
+    """
+    The original path: parse the gzip JSON lines and clean them (in bounded-memory chunks)
+    """
+    return dc.basic_clean_data(sm.read_amenities(json_path))
+
+def _list_column(offsets, codes, dictionary):
+    import pyarrow as pa
+
+    entries = pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), pa.array(dictionary, type=pa.string()))
+    return pa.LargeListArray.from_arrays(pa.array(offsets, type=pa.int64()), entries)
+
+def write_store(data, tags, json_path, store_dir=None, updates=()):
+    """
+    Write encoded data (see encode_tags) to the columnar store of json_path.
+    amenity becomes a dictionary (categorical) column.
+        @param tags: TagTable the 'tag_row' column of data refers to
+        @param updates: names of the change files applied on top of json_path (see osm_update.py)
+    """
+    import pyarrow as pa
+    from pyarrow import feather
+
+    store_path, meta_path = store_paths(json_path, store_dir)
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+
+    # stored rows line up with the tag table rows
+    if 'tag_row' not in data:
+        raise ValueError("write_store expects data as returned by encode_tags")
+    if not np.array_equal(data['tag_row'].to_numpy(), np.arange(len(tags))):
+        tags = tags.take(data['tag_row'].to_numpy())
+
+    frame = data.drop(columns=['tag_row']).assign(amenity=data['amenity'].astype('category'))
+    table = pa.Table.from_pandas(frame.reset_index(drop=True), preserve_index=False)
+    table = table.append_column('tag_keys', _list_column(tags.offsets, tags.key_codes, tags.keys))
+    table = table.append_column('tag_values', _list_column(tags.offsets, tags.value_codes, tags.values))
+
+    # uncompressed and in one record batch so the file can be memory-mapped as is
+    feather.write_feather(table, store_path + '.tmp', compression='uncompressed', chunksize=max(len(table), 1))
+    os.replace(store_path + '.tmp', store_path)
+    with open(meta_path + '.tmp', 'w') as f:
+        meta = {'version': STORE_VERSION, 'rows': len(table), **_source_stamp(json_path), 'updates': list(updates)}
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+
+def read_meta(json_path, store_dir=None):
+    """
+    Metadata of the store of json_path, None if missing or unreadable
+    """
+    _, meta_path = store_paths(json_path, store_dir)
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_is_fresh(json_path, store_dir=None):
+    """
+    True if the store exists and was built from the current json_path
+    (same path, size and modification time) with the current STORE_VERSION
+    """
+    store_path, _ = store_paths(json_path, store_dir)
+    meta = read_meta(json_path, store_dir)
+    if meta is None or not os.path.exists(store_path):
+        return False
+    return meta.get('version') == STORE_VERSION and {k: meta.get(k) for k in ('source', 'size', 'mtime_ns')} == _source_stamp(json_path)
+
+def _decode_list_column(column):
+    """
+    (offsets, codes, dictionary) of a stored tag list column, without copying the arrays
+    """
+    array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    entries = array.values
+    return (array.offsets.to_numpy(zero_copy_only=True),
+            entries.indices.to_numpy(zero_copy_only=True),
+            entries.dictionary.to_pylist())
+
+def read_store(json_path, store_dir=None, decode_tags=False):
+    """
+    Load the store (memory-mapped Arrow file)
+        @param decode_tags: also add a 'tags' column with one dict per row
+        @return (data, TagTable)
+    """
+    from pyarrow import feather
+
+    store_path, _ = store_paths(json_path, store_dir)
+    table = feather.read_table(store_path, memory_map=True)
+
+    offsets, key_codes, keys = _decode_list_column(table.column('tag_keys'))
+    _, value_codes, values = _decode_list_column(table.column('tag_values'))
+    tags = tt.TagTable(offsets, key_codes, value_codes, keys, values)
+
+    data = tt.number_rows(table.drop_columns(['tag_keys', 'tag_values']).to_pandas())
+    if decode_tags:
+        data['tags'] = tt.tags_of(data, tags)
+    return data, tags
+
+def load_amenities(json_path, store_dir=None, refresh=False, decode_tags=False):
+    """
+    Cleaned amenity data for json_path: from the columnar store when it is fresh,
+    otherwise parsed from the JSON (and the store rebuilt for the next run).
+    Without pyarrow installed, or when the store cannot be written, this is the plain JSON path.
+        @param refresh: ignore the store and rebuild it
+        @param decode_tags: also add a 'tags' column with one dict per row
+        @return (data, TagTable of the rows, see tag_table.py)
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        data, tags = encode_tags(read_json(json_path))
+    else:
+        if not refresh and store_is_fresh(json_path, store_dir):
+            return read_store(json_path, store_dir, decode_tags)
+        data, tags = encode_tags(read_json(json_path))
+        try:
+            write_store(data, tags, json_path, store_dir)
+            # same shape as a store read: categorical amenity, memory-mapped tags
+            return read_store(json_path, store_dir, decode_tags)
+        except OSError as e:
+            # no writable cache folder (read-only deployment): keep the parsed JSON
+            print(f"Amenity store not written ({e}), using the JSON file")
+
+    if decode_tags:
+        data['tags'] = tt.tags_of(data, tags)
+    return data, tags
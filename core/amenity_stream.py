@@ -0,0 +1,196 @@
+# Description:
+#   Streaming, bounded-memory ingest of amenity JSON lines (gzip or plain).
+#   Reads the input in chunks, filters every chunk (NaN, bounding box, amenity set)
+#   and drops (lat, lon) duplicates across chunks with a running hash set,
+#   so large extracts can be cleaned without Spark and without loading them whole.
+#
+#   Spark-free replacement for code/just-vancouver.py:
+#       python3 -m core.amenity_stream amenities amenities-vancouver.json.gz
+
+import os
+import sys
+import glob
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+
+# (min lat, max lat, min lon, max lon), bounds excluded, same box as code/just-vancouver.py
+VANCOUVER_BBOX = (49, 49.5, -123.5, -122)
+
+REQUIRED_COLUMNS = ['lat', 'lon', 'timestamp', 'amenity']
+DEFAULT_CHUNK_SIZE = 100_000
+
+def input_files(path):
+    """
+    JSON lines files of path: the file itself, or the part files of a
+    (Spark style) output directory, or the files matching a glob pattern
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                 if name.endswith(('.json', '.json.gz')) and not name.startswith(('.', '_'))]
+    elif os.path.exists(path):
+        files = [path]
+    else:
+        files = sorted(glob.glob(path))
+    if not files:
+        raise FileNotFoundError(path)
+    return files
+
+def filter_chunk(chunk, bbox=None, amenities=None):
+    """
+    Drop rows with missing lat/lon/timestamp/amenity, outside bbox or whose amenity is not in amenities
+        @param bbox: (min lat, max lat, min lon, max lon), bounds excluded
+    """
+    for column in REQUIRED_COLUMNS:
+        if column not in chunk:
+            chunk[column] = np.nan
+    keep = chunk[REQUIRED_COLUMNS].notna().all(axis=1).to_numpy()
+
+    if bbox is not None:
+        min_lat, max_lat, min_lon, max_lon = bbox
+        lat = chunk['lat'].to_numpy(dtype=np.float64, na_value=np.nan)
+        lon = chunk['lon'].to_numpy(dtype=np.float64, na_value=np.nan)
+        keep = keep & (lat > min_lat) & (lat < max_lat) & (lon > min_lon) & (lon < max_lon)
+
+    if amenities is not None:
+        keep = keep & chunk['amenity'].isin(amenities).to_numpy()
+
+    return chunk[keep]
+
+def drop_seen(chunk, seen):
+    """
+    Keep the rows whose (lat, lon) is not in seen (nor earlier in the chunk) and add them to seen
+    """
+    keys = chunk['lat'].to_numpy(dtype=np.float64) + 1j * chunk['lon'].to_numpy(dtype=np.float64)
+    keep = np.fromiter((key not in seen and not seen.add(key) for key in keys.tolist()), dtype=bool, count=len(keys))
+    return chunk[keep]
+
+def stream_amenities(path, bbox=None, amenities=None, chunksize=DEFAULT_CHUNK_SIZE):
+    """
+    Yield cleaned chunks of the amenity JSON lines in path (see input_files).
+    Without bbox / amenities the concatenated chunks equal
+    dc.basic_clean_data(pd.read_json(...)) before its index reset.
+    Filters apply before the dedupe: a duplicate position is kept from its
+    first row that passes them.
+        @param bbox: (min lat, max lat, min lon, max lon), bounds excluded
+        @param amenities: set of amenity types to keep
+        @param chunksize: number of lines parsed at once
+    """
+    seen = set()
+    for file in input_files(path):
+        compression = 'gzip' if file.endswith('.gz') else None
+        # no per-chunk dtype / date inference: a chunk where every timestamp has the
+        # same UTC offset would otherwise come back as datetimes, the others as strings
+        with pd.read_json(file, lines=True, compression=compression, chunksize=chunksize,
+                          dtype=False, convert_dates=False) as reader:
+            for chunk in reader:
+                chunk = drop_seen(filter_chunk(chunk, bbox, amenities), seen)
+                if len(chunk):
+                    yield chunk
+
+def read_amenities(path, bbox=None, amenities=None, chunksize=DEFAULT_CHUNK_SIZE):
+    """
+    Cleaned amenity table of path, built chunk by chunk (see stream_amenities)
+    """
+    chunks = list(stream_amenities(path, bbox, amenities, chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=REQUIRED_COLUMNS + ['name', 'tags'])
+    return pd.concat(chunks, ignore_index=True)
+
+def _json_value(value):
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def json_lines(chunk):
+    """
+    JSON lines (with trailing newline) of the rows of a cleaned chunk
+    """
+    columns = list(chunk.columns)
+    for values in chunk.itertuples(index=False, name=None):
+        record = {column: _json_value(value) for column, value in zip(columns, values)}
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+def open_json_lines(path, compress):
+    """
+    Text file for writing JSON lines, gzip compressed if compress
+    """
+    opener = gzip.open if compress else open
+    return opener(path, 'wt', encoding='utf-8')
+
+def write_json_lines(chunks, output):
+    """
+    Write cleaned chunks as (gzip if output ends with .gz) JSON lines, same format as the input
+        @return number of rows written
+    """
+    rows = 0
+    with open_json_lines(output + '.tmp', output.endswith('.gz')) as f:
+        for chunk in chunks:
+            f.writelines(json_lines(chunk))
+            rows += len(chunk)
+    os.replace(output + '.tmp', output)
+    return rows
+
+def parquet_schema():
+    """
+    Amenity schema, tags as map<string, string> as written by code/osm-amenities.py,
+    plus the OSM node id (null when the input has none)
+    """
+    import pyarrow as pa
+
+    return pa.schema([
+        ('lat', pa.float64()), ('lon', pa.float64()), ('timestamp', pa.string()),
+        ('amenity', pa.string()), ('name', pa.string()), ('id', pa.int64()),
+        ('tags', pa.map_(pa.string(), pa.string())),
+    ])
+
+def parquet_table(chunk, schema):
+    """
+    Arrow table of a cleaned chunk with the given schema (see parquet_schema)
+    """
+    import pyarrow as pa
+
+    tags = [list(t.items()) if isinstance(t, dict) else [] for t in chunk['tags']] if 'tags' in chunk else [[]] * len(chunk)
+    names = chunk['name'] if 'name' in chunk else [None] * len(chunk)
+    ids = chunk['id'] if 'id' in chunk else [None] * len(chunk)
+    return pa.table({
+        'lat': pa.array(chunk['lat'].to_numpy(dtype=np.float64)),
+        'lon': pa.array(chunk['lon'].to_numpy(dtype=np.float64)),
+        'timestamp': pa.array([str(t) for t in chunk['timestamp']], type=pa.string()),
+        'amenity': pa.array([str(a) for a in chunk['amenity']], type=pa.string()),
+        'name': pa.array([None if pd.isna(n) else str(n) for n in names], type=pa.string()),
+        'id': pa.array([None if pd.isna(i) else int(i) for i in ids], type=pa.int64()),
+        'tags': pa.array(tags, type=schema.field('tags').type),
+    }, schema=schema)
+
+def write_parquet(chunks, output):
+    """
+    Write cleaned chunks to a Parquet file, one row group per chunk
+        @return number of rows written
+    """
+    from pyarrow import parquet
+
+    schema = parquet_schema()
+    rows = 0
+    with parquet.ParquetWriter(output + '.tmp', schema) as writer:
+        for chunk in chunks:
+            writer.write_table(parquet_table(chunk, schema))
+            rows += len(chunk)
+    os.replace(output + '.tmp', output)
+    return rows
+
+def main(inputs, output, bbox=VANCOUVER_BBOX):
+    chunks = stream_amenities(inputs, bbox)
+    if output.endswith('.parquet'):
+        rows = write_parquet(chunks, output)
+    else:
+        rows = write_json_lines(chunks, output)
+    print(f"{rows} amenities written to {output}")
+
+if __name__ == '__main__':
+    # python3 -m core.amenity_stream <input file / directory / glob> <output .json.gz or .parquet>
+    main(sys.argv[1], sys.argv[2])
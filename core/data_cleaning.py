@@ -1,6 +1,7 @@
 """
 Cleaning the data
 """
+from core import tag_table as tt
 
 # ==============================================================
 # Cleaning the data for amenities
@@ -14,6 +15,12 @@ INTERESTING_AMENITIES = {'museum', 'theatre', 'arts_centre', 'cinema', 'library'
     'fire_station', 'police'
 }
 
+# types of amenity that count as food places
+FOOD_AMENITIES = {
+    'cafe', 'restaurant', 'fast_food', 'bar', 'pub', 
+    'internet_cafe', 'food_court', 'ice_cream', 'biergarten'
+}
+
 def basic_clean_data(data):
     """
     Clean data
@@ -50,10 +57,8 @@ def get_same_theme_places_by_tags_num(data, theme, tags, n):
     """
     Get same theme places by tags
     """
-    data['tags'] = data['tags'].fillna({})
-    
     # Filter data based on the theme and tags
-    filtered = data[data['tags'].apply(len) > 2].reset_index()
+    filtered = data[tt.tag_counts(data) > 2].reset_index()
     
     return filtered.reset_index(drop=True)
 
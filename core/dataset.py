@@ -0,0 +1,158 @@
+# Description:
+#   The loaded amenity data, built once from the cleaned frame and shared by the
+#   menu options. Rows are partitioned by a categorical amenity column (one
+#   contiguous range per amenity type in a sorted permutation), so category
+#   filters are slices and masks instead of isin scans, and the derived views
+#   (food places, interesting places, ...) are computed once and cached.
+
+import numpy as np
+import pandas as pd
+
+from core import data_cleaning as dc
+from core import spatial_index as si
+
+class Dataset:
+    """
+    Cleaned amenity data plus its category partitions.
+
+    data keeps its row order and labels; positions returned here are data.iloc
+    positions in ascending order, so every view lists its rows in data order
+    (same result as the isin filters it replaces).
+    tags is the TagTable the 'tag_row' column of data refers to (see
+    amenity_store.load_amenities), None if data has no encoded tags.
+    """
+
+    def __init__(self, data, tags=None):
+        if not isinstance(data['amenity'].dtype, pd.CategoricalDtype):
+            data = data.assign(amenity=data['amenity'].astype('category'))
+        self.data = data
+        self.tags = tags
+
+        codes = data['amenity'].cat.codes.to_numpy()
+        categories = data['amenity'].cat.categories
+        # rows sorted by amenity (stable: data order inside a type) and the range of every type
+        self._order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[self._order], np.arange(len(categories) + 1))
+        self._ranges = {amenity: (lo, hi) for amenity, lo, hi in zip(categories, bounds[:-1], bounds[1:]) if lo < hi}
+
+        self._masks = {}
+        self._views = {}
+        self._spatial_index = None
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def spatial_index(self):
+        """
+        SpatialIndex over data, built on first use
+        """
+        if self._spatial_index is None:
+            self._spatial_index = si.SpatialIndex.from_frame(self.data)
+        return self._spatial_index
+
+    def amenity_types(self):
+        """
+        Amenity types present in the data, sorted
+        """
+        return sorted(self._ranges)
+
+    def count(self, amenity):
+        lo, hi = self._ranges.get(amenity, (0, 0))
+        return hi - lo
+
+    def positions(self, amenities):
+        """
+        Ascending data.iloc positions of the rows of one amenity type (str) or a set of types
+        """
+        if isinstance(amenities, str):
+            amenities = (amenities,)
+        slices = [self._order[lo:hi] for lo, hi in (self._ranges[a] for a in amenities if a in self._ranges)]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(slices))
+
+    def mask(self, amenities):
+        """
+        Boolean array over data: amenity in amenities (cached per set of types)
+        """
+        key = frozenset((amenities,) if isinstance(amenities, str) else amenities)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.zeros(len(self.data), dtype=bool)
+            mask[self.positions(key)] = True
+            mask.flags.writeable = False
+            self._masks[key] = mask
+        return mask
+
+    def rows(self, amenities):
+        """
+        Rows of the given amenity type(s), labels kept
+        """
+        return self.data.iloc[self.positions(amenities)]
+
+    def view(self, name, build):
+        """
+        Cached result of build() under name (views and other data derived from data)
+        """
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = build()
+        return view
+
+    def food_places(self):
+        """
+        Food places (dc.FOOD_AMENITIES), labels kept, cached
+        """
+        return self.view('food', lambda: self.rows(dc.FOOD_AMENITIES))
+
+    def not_food_places(self):
+        """
+        All but the food places, labels kept, cached
+        """
+        return self.view('not_food', lambda: self.data[~self.mask(dc.FOOD_AMENITIES)])
+
+    def interesting_places(self):
+        """
+        Same as dc.get_interesting_places(data), cached
+        """
+        return self.view('interesting', lambda: self.rows(dc.INTERESTING_AMENITIES).reset_index(drop=True))
+
+    def same_theme_places(self, theme):
+        """
+        Same as dc.get_same_theme_places(data, theme)
+        """
+        return self.rows(theme.lower().strip()).reset_index(drop=True)
+
+def frame(data):
+    """
+    The DataFrame of data, which is a DataFrame or a Dataset
+    """
+    return data.data if isinstance(data, Dataset) else data
+
+def food_places(data):
+    """
+    Food places (dc.FOOD_AMENITIES) of data (DataFrame or Dataset), labels kept
+    """
+    if isinstance(data, Dataset):
+        return data.food_places()
+    return data[data['amenity'].isin(dc.FOOD_AMENITIES)]
+
+def not_food_places(data):
+    """
+    Places of data (DataFrame or Dataset) that are not food places, labels kept
+    """
+    if isinstance(data, Dataset):
+        return data.not_food_places()
+    return data[~data['amenity'].isin(dc.FOOD_AMENITIES)]
+
+def category_mask(data, amenities, positions=None):
+    """
+    Boolean array over the rows of data (DataFrame or Dataset): amenity in amenities
+        @param positions: only for these data.iloc positions
+    """
+    if isinstance(data, Dataset):
+        mask = data.mask(amenities)
+        return mask if positions is None else mask[positions]
+    amenity = data['amenity'] if positions is None else data['amenity'].iloc[positions]
+    return amenity.isin(amenities).to_numpy()
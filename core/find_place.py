@@ -1,13 +1,10 @@
 import sys
 import pandas as pd
 import numpy as np
-import folium
-from folium.plugins import MarkerCluster
-
-FOOD_AMENITIES = {
-    'cafe', 'restaurant', 'fast_food', 'bar', 'pub', 
-    'internet_cafe', 'food_court', 'ice_cream', 'biergarten'
-}
+from core import spatial_index as si
+from core import data_cleaning as dc
+from core import dataset as ds
+from core import marker_map as mm
 
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371000
@@ -24,62 +21,80 @@ def haversine(lat1, lon1, lat2, lon2):
     
     return distances
 
-def filter_food_place(data):
-    food = data[data['amenity'].isin(FOOD_AMENITIES)]
-    return food
-
-def filter_not_food_place(data):
-    not_food = data[~data['amenity'].isin(FOOD_AMENITIES)]
-    return not_food
-
-def find_near_amenities(photo, amenity):
-    amenity = filter_not_food_place(amenity)
-    near_amenity = []
+def _spatial_index(amenity, index):
+    if index is not None:
+        return index
+    if isinstance(amenity, ds.Dataset):
+        return amenity.spatial_index
+    return si.SpatialIndex.from_frame(amenity)
+
+def _near_places(photo, amenity, max_distance_km, food, index):
+    index = _spatial_index(amenity, index)
+
+    idx, distances = index.query_radius(photo['latitude'], photo['longitude'], max_distance_km)
+    is_food = ds.category_mask(amenity, dc.FOOD_AMENITIES, idx)
+    keep = is_food if food else ~is_food
+
+    places = ds.frame(amenity).iloc[idx[keep]]
+    return [(row, distance) for (_, row), distance in zip(places.iterrows(), distances[keep])]
+
+def find_near_amenities(photo, amenity, index=None):
+    """
+    Find non-food places within 1 km of the photo, sorted by distance
+        @param amenity: DataFrame or Dataset
+        @param index: SpatialIndex built over amenity (built on the fly if None)
+    """
     max_distance_km = 1
-    
-    for _, row in amenity.iterrows():
-        distance = haversine(photo['latitude'], photo['longitude'], row['lat'], row['lon'])
-        if distance <= max_distance_km:
-            near_amenity.append((row, distance))
-    return sorted(near_amenity, key = lambda x: x[1])
-
-def find_near_food(photo, amenity, max_distance_km):
-    amenity = filter_food_place(amenity)
-    near_food = []
-    for _, row in amenity.iterrows():
-        distance = haversine(photo['latitude'], photo['longitude'], row['lat'], row['lon'])
-        if distance <= max_distance_km:
-            near_food.append((row, distance))
-    return sorted(near_food, key = lambda x: x[1])
+    return _near_places(photo, amenity, max_distance_km, False, index)
+
+def find_near_food(photo, amenity, max_distance_km, index=None):
+    """
+    Find food places within max_distance_km of the photo, sorted by distance
+        @param index: SpatialIndex built over amenity (built on the fly if None)
+    """
+    return _near_places(photo, amenity, max_distance_km, True, index)
+
+def find_near_amenities_batch(photos, amenity, max_distance_km=1, index=None):
+    """
+    Find non-food places near every photo in one vectorized pass
+        @param photos: DataFrame with 'latitude' / 'longitude' columns
+        @param index: SpatialIndex built over amenity (built on the fly if None)
+        @return (offsets, positions, distances): the places near photo i are
+            amenity.iloc[positions[offsets[i]:offsets[i + 1]]], sorted by distance
+    """
+    index = _spatial_index(amenity, index)
+
+    not_food = ~ds.category_mask(amenity, dc.FOOD_AMENITIES)
+    return index.query_radius_batch(
+        photos['latitude'].to_numpy(), photos['longitude'].to_numpy(), max_distance_km, mask=not_food)
 
 def show_all_amenity_type(data):
+    if isinstance(data, ds.Dataset):
+        return pd.Series(data.amenity_types(), name='amenity')
     unique = data[['amenity']].drop_duplicates()
     unique = unique['amenity'].sort_values()
     return unique
 
 def make_map(amenity, amenity_type):
-    amenity = amenity[amenity['amenity'] == amenity_type]
-
-    m = folium.Map(location = [amenity['lat'].mean(), amenity['lon'].mean()], zoom_start = 10)
-    marker = MarkerCluster().add_to(m)
+    if isinstance(amenity, ds.Dataset):
+        amenity = amenity.rows(amenity_type)
+    else:
+        amenity = amenity[amenity['amenity'] == amenity_type]
 
-    for _, row in amenity.iterrows():
-        name = row['name']
-        text = f'{name} ({row['amenity']})'
-        folium.Marker(
-            location = [row['lat'], row['lon']],
-            popup = text,
-            icon = folium.Icon(color = 'red')
-        ).add_to(marker)
+    return mm.points_map(amenity, mm.icon_options(color = 'red'))
 
-    return m
+def tour(photo, amenity, index=None):
+    offsets, positions, distances = find_near_amenities_batch(photo, amenity, index=index)
+    amenity = ds.frame(amenity)
 
-def tour(photo, amenity):
     route = []
-    for _, row in photo.iterrows():
-        near_amenity = find_near_amenities(row, amenity)
-        if near_amenity:
-            route.append((photo, near_amenity))
+    for i, (_, row) in enumerate(photo.iterrows()):
+        lo, hi = offsets[i], offsets[i + 1]
+        if lo == hi:
+            continue
+        places = amenity.iloc[positions[lo:hi]]
+        near_amenity = [(place, distance) for (_, place), distance in zip(places.iterrows(), distances[lo:hi])]
+        route.append((row, near_amenity))
     return route
 
 
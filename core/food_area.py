@@ -1,31 +1,287 @@
 import sys
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
 import folium
-from folium.plugins import MarkerCluster
+from branca.colormap import LinearColormap
+from core import spatial_index as si
+from core import dataset as ds
+from core import marker_map as mm
 
-FOOD_AMENITIES = {
-    'cafe', 'restaurant', 'fast_food', 'bar', 'pub', 
-    'internet_cafe', 'food_court', 'ice_cream', 'biergarten'
-}
+# ~250 m cells, about a city block
+DEFAULT_CELL_KM = 0.25
+# food places in a cell for it to be part of a hotspot
+DEFAULT_MIN_COUNT = 5
 
-def filter_food_place(data):
-    food = data[data['amenity'].isin(FOOD_AMENITIES)]
-    return food
+# boundary edges of a cell (col x, row y): (neighbour offset, start vertex, end vertex),
+# counter-clockwise, so the cell is on the left of every edge
+_CELL_EDGES = (
+    ((0, -1), (0, 0), (1, 0)),
+    ((1, 0), (1, 0), (1, 1)),
+    ((0, 1), (1, 1), (0, 1)),
+    ((-1, 0), (0, 1), (0, 0)),
+)
 
 def create_food_map(amenity):
-    food = filter_food_place(amenity)
+    food = ds.food_places(amenity)
 
-    m = folium.Map(location = [food['lat'].mean(), food['lon'].mean()], zoom_start = 10)
-    marker = MarkerCluster().add_to(m)
+    return mm.points_map(food, mm.icon_options(color = 'red', icon = 'cutlery', prefix = 'fa'))
 
-    for _, row in food.iterrows():
-        name = row['name']
-        text = f'{name} ({row['amenity']})'
-        folium.Marker(
-            location = [row['lat'], row['lon']],
-            popup = text,
-            icon = folium.Icon(color = 'red', icon = 'cutlery', prefix = 'fa')
-        ).add_to(marker)
+def _cell_keys(rows, cols):
+    """
+    Unique sortable key of every (row, col) cell, with room for the neighbours of every cell
+        @return (keys, key step of one row up)
+    """
+    if len(rows) == 0:
+        return np.asarray(rows, dtype=np.int64), 1
+    width = int(cols.max() - cols.min()) + 3
+    return (rows - rows.min() + 1) * width + (cols - cols.min() + 1), width
 
-    return m
\ No newline at end of file
+def food_grid(data, cell_km=DEFAULT_CELL_KM):
+    """
+    Count the food places of data in a regular grid of cell_km x cell_km cells
+    (the lon step is taken at the mean latitude of the food places).
+        @param data: DataFrame or Dataset
+        @return DataFrame with one row per non-empty cell: row, col (cell numbers),
+            lat_min, lat_max, lon_min, lon_max, count and one count column per food amenity type;
+            grid.attrs has the 'lat_step' / 'lon_step' of the cells in degrees
+    """
+    food = ds.food_places(data)
+    lat = food['lat'].to_numpy(dtype=np.float64)
+    lon = food['lon'].to_numpy(dtype=np.float64)
+    types, type_names = pd.factorize(food['amenity'].astype(str), sort=True)
+
+    lat_step = cell_km / si.KM_PER_DEG_LAT
+    lon_step = lat_step / max(np.cos(np.radians(lat.mean())), 1e-6) if len(lat) else lat_step
+    rows = np.floor(lat / lat_step).astype(np.int64)
+    cols = np.floor(lon / lon_step).astype(np.int64)
+
+    keys, _ = _cell_keys(rows, cols)
+    cell_keys, first, cell = np.unique(keys, return_index=True, return_inverse=True)
+    n_cells, n_types = len(cell_keys), len(type_names)
+    by_type = np.bincount(cell * n_types + types, minlength=n_cells * n_types).reshape(n_cells, n_types)
+
+    grid = pd.DataFrame({
+        'row': rows[first],
+        'col': cols[first],
+        'lat_min': rows[first] * lat_step,
+        'lat_max': (rows[first] + 1) * lat_step,
+        'lon_min': cols[first] * lon_step,
+        'lon_max': (cols[first] + 1) * lon_step,
+        'count': by_type.sum(axis=1),
+    })
+    for i, name in enumerate(type_names):
+        grid[name] = by_type[:, i]
+    grid.attrs['lat_step'] = lat_step
+    grid.attrs['lon_step'] = lon_step
+    return grid
+
+def label_cells(grid, min_count=DEFAULT_MIN_COUNT):
+    """
+    Hotspot of every cell of the grid: the cells with at least min_count food
+    places, joined with the dense cells next to them (sharing a side).
+    Hotspots are numbered 0, 1, ... by decreasing number of food places.
+        @return int array over the grid rows, -1 for the cells not in a hotspot
+    """
+    labels = np.full(len(grid), -1, dtype=np.int64)
+    dense = np.flatnonzero(grid['count'].to_numpy() >= min_count)
+    if len(dense) == 0:
+        return labels
+
+    keys, width = _cell_keys(grid['row'].to_numpy()[dense], grid['col'].to_numpy()[dense])
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    # edges to the dense cell on the right and the one above
+    src, dst = [], []
+    for step in (1, width):
+        at = np.searchsorted(sorted_keys, keys + step)
+        found = sorted_keys[np.minimum(at, len(keys) - 1)] == keys + step
+        src.append(np.flatnonzero(found))
+        dst.append(order[at[found]])
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    graph = sp.coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(len(keys), len(keys)))
+    _, components = connected_components(graph, directed=False)
+
+    # renumber by decreasing count (ties by first cell)
+    totals = np.bincount(components, weights=grid['count'].to_numpy()[dense])
+    rank = np.empty(len(totals), dtype=np.int64)
+    rank[np.argsort(-totals, kind='stable')] = np.arange(len(totals))
+    labels[dense] = rank[components]
+    return labels
+
+def _boundary_edges(keys, width, rows, cols):
+    """
+    Directed boundary edges (x0, y0, x1, y1) of a set of cells, in cell-corner
+    units (x = col, y = row), with the cells on the left of every edge
+        @param keys, width: see _cell_keys
+    """
+    sorted_keys = np.sort(keys)
+    edges = []
+    for (dx, dy), (sx, sy), (ex, ey) in _CELL_EDGES:
+        neighbours = keys + dx + dy * width
+        at = np.minimum(np.searchsorted(sorted_keys, neighbours), len(sorted_keys) - 1)
+        outside = sorted_keys[at] != neighbours
+        x, y = cols[outside], rows[outside]
+        edges.append(np.column_stack([x + sx, y + sy, x + ex, y + ey]))
+    return np.concatenate(edges)
+
+def _rings(edges):
+    """
+    Chain boundary edges into closed rings of corners. Where two rings touch at a
+    corner the left turn is taken, so every ring is a simple polygon: the outer
+    ring is counter-clockwise, the rings of holes are clockwise.
+    """
+    edges = edges.tolist()
+    outgoing = {}
+    for i, (x0, y0, _, _) in enumerate(edges):
+        outgoing.setdefault((x0, y0), []).append(i)
+
+    def successor(i):
+        x0, y0, x1, y1 = edges[i]
+        choices = outgoing[(x1, y1)]
+        if len(choices) == 1:
+            return choices[0]
+        # direction (dx, dy) turned left is (-dy, dx)
+        left = (x1 - (y1 - y0), y1 + (x1 - x0))
+        return next((j for j in choices if tuple(edges[j][2:]) == left), choices[0])
+
+    rings = []
+    done = [False] * len(edges)
+    for first in range(len(edges)):
+        if done[first]:
+            continue
+        ring = []
+        i = first
+        while not done[i]:
+            done[i] = True
+            ring.append(tuple(edges[i][:2]))
+            i = successor(i)
+        # keep the corners only
+        rings.append([p for k, p in enumerate(ring)
+                      if (p[0] - ring[k - 1][0]) * (ring[(k + 1) % len(ring)][1] - p[1])
+                      != (p[1] - ring[k - 1][1]) * (ring[(k + 1) % len(ring)][0] - p[0])])
+    return rings
+
+def _signed_area(ring):
+    x = np.array([p[0] for p in ring], dtype=np.float64)
+    y = np.array([p[1] for p in ring], dtype=np.float64)
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+def _polygon(rings, lat_step, lon_step):
+    """
+    GeoJSON Polygon of the rings of one hotspot (outer ring first, then the holes)
+    """
+    rings = sorted(rings, key=_signed_area, reverse=True)
+    coordinates = []
+    for ring in rings:
+        ring = ring + ring[:1]
+        coordinates.append([[round(x * lon_step, mm.COORD_DECIMALS), round(y * lat_step, mm.COORD_DECIMALS)]
+                            for x, y in ring])
+    return {'type': 'Polygon', 'coordinates': coordinates}
+
+def find_hotspots(grid, min_count=DEFAULT_MIN_COUNT):
+    """
+    Dense food areas of a food_grid: connected cells with at least min_count food places each
+        @return DataFrame with one row per hotspot, largest first: hotspot, cells, count,
+            one count column per food amenity type, lat / lon (center of the food places'
+            cells) and geometry (GeoJSON Polygon of the area)
+    """
+    type_columns = list(grid.columns[grid.columns.get_loc('count') + 1:])
+    labels = label_cells(grid, min_count)
+    inside = labels >= 0
+    n = int(labels.max()) + 1 if inside.any() else 0
+
+    counts = grid['count'].to_numpy()[inside]
+    hot = labels[inside]
+    center_lat = (grid['lat_min'] + grid['lat_max']).to_numpy()[inside] / 2
+    center_lon = (grid['lon_min'] + grid['lon_max']).to_numpy()[inside] / 2
+    weight = np.maximum(np.bincount(hot, weights=counts, minlength=n), 1)
+
+    hotspots = pd.DataFrame({
+        'hotspot': np.arange(n),
+        'cells': np.bincount(hot, minlength=n),
+        'count': np.bincount(hot, weights=counts, minlength=n).astype(np.int64),
+    })
+    for name in type_columns:
+        hotspots[name] = np.bincount(hot, weights=grid[name].to_numpy()[inside], minlength=n).astype(np.int64)
+    hotspots['lat'] = np.bincount(hot, weights=center_lat * counts, minlength=n) / weight
+    hotspots['lon'] = np.bincount(hot, weights=center_lon * counts, minlength=n) / weight
+
+    # cells of every hotspot as one slice
+    order = np.argsort(hot, kind='stable')
+    rows = grid['row'].to_numpy()[inside][order]
+    cols = grid['col'].to_numpy()[inside][order]
+    keys, width = _cell_keys(rows, cols)
+    bounds = np.searchsorted(hot[order], np.arange(n + 1))
+    hotspots['geometry'] = [
+        _polygon(_rings(_boundary_edges(keys[lo:hi], width, rows[lo:hi], cols[lo:hi])),
+                 grid.attrs['lat_step'], grid.attrs['lon_step'])
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+    return hotspots
+
+def food_hotspots(data, cell_km=DEFAULT_CELL_KM, min_count=DEFAULT_MIN_COUNT):
+    """
+    find_hotspots over the food_grid of data
+        @param data: DataFrame or Dataset
+    """
+    return find_hotspots(food_grid(data, cell_km), min_count)
+
+def hotspots_geojson(hotspots):
+    """
+    GeoJSON FeatureCollection of the hotspots, the other columns as properties
+    """
+    properties = hotspots.drop(columns=['geometry'])
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': geometry, 'properties': props}
+        for geometry, props in zip(hotspots['geometry'], properties.to_dict('records'))
+    ]}
+
+def cells_geojson(grid):
+    """
+    GeoJSON FeatureCollection of the grid cells (one square per non-empty cell), with their counts
+    """
+    lat_min, lat_max = np.round(grid['lat_min'].to_numpy(), mm.COORD_DECIMALS), np.round(grid['lat_max'].to_numpy(), mm.COORD_DECIMALS)
+    lon_min, lon_max = np.round(grid['lon_min'].to_numpy(), mm.COORD_DECIMALS), np.round(grid['lon_max'].to_numpy(), mm.COORD_DECIMALS)
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature',
+         'geometry': {'type': 'Polygon', 'coordinates': [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]},
+         'properties': {'count': count}}
+        for y0, y1, x0, x1, count in zip(lat_min.tolist(), lat_max.tolist(), lon_min.tolist(), lon_max.tolist(),
+                                         grid['count'].tolist())
+    ]}
+
+def create_food_density_map(amenity, cell_km=DEFAULT_CELL_KM, min_count=DEFAULT_MIN_COUNT):
+    """
+    Choropleth of the food places per grid cell with the hotspot areas on top
+    (one polygon per cell / hotspot instead of one marker per place)
+        @param amenity: DataFrame or Dataset
+    """
+    grid = food_grid(amenity, cell_km)
+    hotspots = find_hotspots(grid, min_count)
+    type_columns = list(grid.columns[grid.columns.get_loc('count') + 1:])
+
+    m = folium.Map(location = [(grid['lat_min'] + grid['lat_max']).mean() / 2,
+                               (grid['lon_min'] + grid['lon_max']).mean() / 2], zoom_start = 12)
+    colormap = LinearColormap(['#ffffb2', '#fd8d3c', '#bd0026'], vmin = 1, vmax = max(int(grid['count'].max()), 2),
+                              caption = 'food places per cell').to_step(7)
+
+    folium.GeoJson(
+        cells_geojson(grid),
+        name = 'food places per cell',
+        style_function = lambda feature: {'fillColor': colormap(feature['properties']['count']),
+                                          'fillOpacity': 0.6, 'weight': 0},
+        tooltip = folium.GeoJsonTooltip(['count']),
+    ).add_to(m)
+    if len(hotspots):
+        folium.GeoJson(
+            hotspots_geojson(hotspots),
+            name = 'food hotspots',
+            style_function = lambda feature: {'color': '#800026', 'weight': 2, 'fillOpacity': 0},
+            tooltip = folium.GeoJsonTooltip(['hotspot', 'count'] + type_columns),
+        ).add_to(m)
+    colormap.add_to(m)
+    folium.LayerControl().add_to(m)
+    return m
@@ -1,10 +1,19 @@
 import sys
+import bisect
+import numpy as np
 import pandas as pd
 from core import data_cleaning as dc
+from core import dataset as ds
+from core import spatial_index as si
 
-def show_theme():
+def show_theme(ranking=None):
     print("\n##############################################\n")
     print("Themes:")
+    if ranking is not None:
+        for i, (theme, count) in enumerate(sorted(ranking.themes().items()), 1):
+            print(f"{i}. {theme} ({count} places)")
+        return
+
     i = 1
     for theme in dc.INTERESTING_AMENITIES:
         print(f"{i}. {theme}")
@@ -41,6 +50,57 @@ def calc_score(row):
 
     return score
 
+def calc_scores(data):
+    """
+    Vectorized calc_score for every row of the given data
+        @return Series of scores aligned with data.index
+    """
+    name = data['name'].astype(object) if 'name' in data else pd.Series(np.nan, index=data.index, dtype=object)
+    short_name = name.isna().to_numpy() | (name.str.strip().str.len() < 5).to_numpy()
+
+    if 'tag_count' in data:
+        # derived at ingest (see amenity_store.encode_tags)
+        tag_count = data['tag_count'].to_numpy()
+        has_wiki = data['has_wikipedia'].to_numpy(dtype=bool) | data['has_wikidata'].to_numpy(dtype=bool)
+    else:
+        tags = data['tags'] if 'tags' in data else pd.Series([{}] * len(data), index=data.index, dtype=object)
+        tags = tags.map(lambda t: t if isinstance(t, dict) else {})
+        tag_count = tags.map(len).to_numpy()
+        has_wiki = tags.map(lambda t: 'wikipedia' in t or 'wikidata' in t).to_numpy(dtype=bool)
+
+    score = short_name.astype(np.int64)
+    score += np.where(tag_count >= 11, 3, np.where(tag_count >= 6, 2, 1))
+    score += ~has_wiki
+    return pd.Series(score, index=data.index)
+
+def add_hidden_score(data):
+    """
+    Return a copy of data with the 'hidden_score' column precomputed.
+    Call once at load time so every later query reuses the score.
+    """
+    return data.assign(hidden_score=calc_scores(data))
+
+def top_n_positions(scores, n):
+    """
+    Positions of the n highest scores, best first (ties keep row order).
+    Uses a partial selection instead of sorting the whole column.
+    """
+    scores = np.asarray(scores)
+    n = min(n, len(scores))
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if n < len(scores):
+        # n-th largest score; take everything above it plus the first ties
+        kth = np.partition(scores, len(scores) - n)[len(scores) - n]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:n - len(above)]
+        candidates = np.sort(np.concatenate([above, ties]))
+    else:
+        candidates = np.arange(len(scores))
+
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
 def find_n_hidden_gems(data, n=5):
     """
     Find Top n hidden gems from the given filtered (or non-filtered) data
@@ -57,34 +117,163 @@ def find_n_hidden_gems(data, n=5):
     @param n: Number of hidden gems to find (default = 10)
     """
 
-    # Apply scoring
-    data['hidden_score'] = data.apply(calc_score, axis=1)
+    # Reuse the score computed at load time (see add_hidden_score)
+    if 'hidden_score' not in data:
+        data = add_hidden_score(data)
 
     # get Top-n
-    top_n = data.sort_values(by='hidden_score', ascending=False).head(n).reset_index(drop=True)
+    top_n = data.iloc[top_n_positions(data['hidden_score'], n)].reset_index(drop=True)
     return top_n
 
-def find_hidden_gems_by_type(data, amenity, n=5):
+class ThemeRanking:
+    """
+    Hidden gems ranked per amenity type, so a theme query is a direct lookup.
+
+    Each amenity keeps a list of (-hidden_score, seq, label) keys sorted best
+    first; seq is the insertion order, so ties keep row order.
+    Rows are identified by their data.index label and can be added or removed
+    incrementally.
+    """
+    COLUMNS = ['name', 'amenity', 'lat', 'lon', 'hidden_score']
+
+    def __init__(self, data=None):
+        self._ranks = {}
+        self._rows = {}
+        self._seq = 0
+        if data is not None:
+            self.add(data)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, label):
+        return label in self._rows
+
+    def add(self, data):
+        """
+        Add (or replace) the rows of data, scoring them if needed
+        """
+        if 'hidden_score' not in data:
+            data = add_hidden_score(data)
+        self.remove([label for label in data.index if label in self._rows])
+
+        touched = set()
+        records = data[self.COLUMNS].itertuples(index=True, name=None)
+        for label, *record in records:
+            key = (-record[4], self._seq, label)
+            self._seq += 1
+            self._rows[label] = (key, tuple(record))
+            self._ranks.setdefault(record[1], []).append(key)
+            touched.add(record[1])
+
+        # appended keys form a sorted tail, so this is close to a merge
+        for amenity in touched:
+            self._ranks[amenity].sort()
+
+    def remove(self, labels):
+        """
+        Remove the rows with the given data.index labels
+        """
+        for label in labels:
+            key, record = self._rows.pop(label)
+            ranks = self._ranks[record[1]]
+            del ranks[bisect.bisect_left(ranks, key)]
+            if not ranks:
+                del self._ranks[record[1]]
+
+    def themes(self):
+        """
+        Number of ranked places per amenity type
+        """
+        return {amenity: len(ranks) for amenity, ranks in self._ranks.items()}
+
+    def top(self, amenity, n=5):
+        """
+        Top n hidden gems of the amenity type, None if there is none
+        """
+        ranks = self._ranks.get(amenity.lower().strip())
+        if not ranks:
+            return None
+
+        records = [self._rows[label][1] for _, _, label in ranks[:n]]
+        return pd.DataFrame(records, columns=self.COLUMNS)
+
+def build_theme_ranking(data):
+    """
+    Build the ThemeRanking over the interesting places of the cleaned data.
+    Labels stay those of data, so rows can later be added / removed by label.
+        @param data: DataFrame or Dataset
+    """
+    if isinstance(data, ds.Dataset):
+        return ThemeRanking(data.rows(dc.INTERESTING_AMENITIES))
+    return ThemeRanking(data[data['amenity'].isin(dc.INTERESTING_AMENITIES)])
+
+def find_hidden_gems_by_type(data, amenity, n=5, ranking=None):
     """
     Find up to N hidden gems of a specific amenity type.
 
     @param data: The filtered data containing interesting places
     @param amenity: The type of amenity to filter by
     @param n: Number of top hidden places to return (default = 5)
+    @param ranking: precomputed ThemeRanking, looked up directly if given
     """
-    data = find_n_hidden_gems(data, n=len(data))
+    if ranking is not None:
+        return ranking.top(amenity, n)
 
-    # Now filter and return top-N by amenity
-    subset = dc.get_same_theme_places(data, amenity)
+    # Only score and rank the places of this theme
+    if isinstance(data, ds.Dataset):
+        subset = data.same_theme_places(amenity)
+    else:
+        subset = dc.get_same_theme_places(data, amenity)
     if subset.empty:
         return None
-    
-    return subset[['name', 'amenity', 'lat', 'lon', 'hidden_score']].head(n).reset_index(drop=True)
+
+    return find_n_hidden_gems(subset, n)[['name', 'amenity', 'lat', 'lon', 'hidden_score']]
+
 
 
+# radius (km) and distance weight (score points per km) of the gems near a start
+# point, by tour mode
+NEAR_GEMS_SEARCH = {
+    'straight': (5, 1.0),
+    'walk': (3, 1.0),
+    'drive': (20, 0.25),
+}
 
-def show_interesting_places(data, n, option, theme=None):
-    filtered_places = dc.get_interesting_places(data)
+def find_hidden_gems_near(data, lat, lon, k=5, radius_km=5, distance_weight=1.0, index=None):
+    """
+    Find the top k interesting places within radius_km of (lat, lon), ranked by
+    hidden_score - distance_weight * distance (km): a place 1 km further away
+    needs distance_weight more points. Best-first search on the spatial index
+    (SpatialIndex.query_best), so only the cells around the top k are read.
+
+    @param data: Dataset (index and per-cell best scores cached) or DataFrame
+    @param index: SpatialIndex built over data (built on the fly if None)
+    @return DataFrame like find_n_hidden_gems plus 'distance_km' and 'gem_score', best first
+    """
+    frame = ds.frame(data)
+    if 'hidden_score' not in frame:
+        frame = add_hidden_score(frame)
+    score = frame['hidden_score'].to_numpy(dtype=np.float64)
+    mask = ds.category_mask(data, dc.INTERESTING_AMENITIES)
+
+    cell_max = None
+    if isinstance(data, ds.Dataset) and (index is None or index is data.spatial_index):
+        index = data.spatial_index
+        cell_max = data.view('interesting_cell_max', lambda: index.cell_maxima(score, mask))
+    elif index is None:
+        index = si.SpatialIndex.from_frame(frame)
+
+    positions, distances, values = index.query_best(lat, lon, k, radius_km, score, distance_weight, cell_max, mask)
+    gems = frame.iloc[positions].reset_index(drop=True)
+    return gems.assign(distance_km=distances, gem_score=values)
+
+
+def show_interesting_places(data, n, option, theme=None, ranking=None):
+    if isinstance(data, ds.Dataset):
+        filtered_places = data.interesting_places()
+    else:
+        filtered_places = dc.get_interesting_places(data)
     top = find_n_hidden_gems(filtered_places, n)
     
     if option == 1:
@@ -92,7 +281,7 @@ def show_interesting_places(data, n, option, theme=None):
         print(top[['name', 'amenity', 'lat', 'lon', 'hidden_score']])
         
     elif option == 2:
-        hidden_pubs = find_hidden_gems_by_type(filtered_places, theme, n)
+        hidden_pubs = find_hidden_gems_by_type(filtered_places, theme, n, ranking)
         if hidden_pubs is not None:
             print(f"\nTop {n} Hidden Gems for {theme}:\n")
             print(hidden_pubs[['name', 'amenity', 'lat', 'lon', 'hidden_score']])
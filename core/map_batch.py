@@ -0,0 +1,141 @@
+# Description:
+#   Batch rendering of the map of every amenity type (the {amenity}_map.html of
+#   option 11) in a process pool. The data is grouped by amenity once; a
+#   manifest keeps a content hash of the rows of every rendered type, so a
+#   later run only renders the types whose rows changed.
+#
+#   Render the maps of an amenity JSON file (from the repository root):
+#       python3 -m core.map_batch amenities-vancouver.json.gz [output folder] [processes]
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import multiprocessing
+
+import pandas as pd
+
+from core import amenity_store as st
+from core import dataset as ds
+from core import find_place as fp
+from core import marker_map as mm
+
+# bump when make_map changes, so every map is rendered again
+RENDER_VERSION = 1
+MANIFEST = 'manifest.json'
+# columns of the rows that end up in a map
+MAP_COLUMNS = ['lat', 'lon', 'name', 'amenity']
+
+# override the location with TOUR_MAP_DIR
+MAP_DIR = os.environ.get(
+    'TOUR_MAP_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maps'))
+
+def map_file(amenity):
+    """
+    File name of the map of an amenity type: {amenity}_map.html like option 11,
+    other characters than letters, digits, '_' and '-' replaced (plus a short hash then)
+    """
+    safe = re.sub(r'[^A-Za-z0-9_-]', '_', amenity)
+    if safe != amenity:
+        safe += '_' + hashlib.sha1(amenity.encode('utf-8')).hexdigest()[:8]
+    return f'{safe}_map.html'
+
+def rows_hash(rows):
+    """
+    Content hash of the map rows of one type (and of the rendering settings)
+    """
+    digest = hashlib.sha256(json.dumps([RENDER_VERSION, mm.COORD_DECIMALS]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(rows[MAP_COLUMNS], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def read_manifest(out_dir):
+    """
+    {amenity: {'file', 'hash', 'rows'}} of the last run, {} if none
+    """
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            return json.load(f)['maps']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def write_manifest(out_dir, maps):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'version': RENDER_VERSION, 'maps': maps}, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def render_map(task):
+    """
+    Render and save the map of one amenity type (runs in a worker process)
+    """
+    amenity, rows, path = task
+    fp.make_map(rows, amenity).save(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return amenity
+
+def render_all(data, out_dir=None, processes=None, force=False):
+    """
+    Render the map of every amenity type of data into out_dir, skipping the
+    types whose rows have the same hash as in the manifest (unless force).
+    Maps of types no longer in data are removed.
+        @param data: DataFrame or Dataset
+        @return {'rendered': [...], 'skipped': [...], 'removed': [...]}
+    """
+    out_dir = out_dir or MAP_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    if not isinstance(data, ds.Dataset):
+        data = ds.Dataset(data)
+    frame = ds.frame(data)[MAP_COLUMNS]
+
+    previous = read_manifest(out_dir)
+    maps = {}
+    tasks = []
+    skipped = []
+    for amenity in data.amenity_types():
+        rows = frame.iloc[data.positions(amenity)]
+        entry = {'file': map_file(amenity), 'hash': rows_hash(rows), 'rows': len(rows)}
+        maps[amenity] = entry
+        path = os.path.join(out_dir, entry['file'])
+        if not force and previous.get(amenity) == entry and os.path.exists(path):
+            skipped.append(amenity)
+        else:
+            tasks.append((amenity, rows, path))
+
+    removed = sorted(set(previous) - set(maps))
+    for amenity in removed:
+        path = os.path.join(out_dir, previous[amenity]['file'])
+        if os.path.exists(path):
+            os.remove(path)
+
+    # largest maps first, so they do not end up last on one worker
+    tasks.sort(key=lambda task: len(task[1]), reverse=True)
+    rendered = []
+    try:
+        if tasks:
+            with multiprocessing.Pool(processes) as pool:
+                for amenity in pool.imap_unordered(render_map, tasks):
+                    rendered.append(amenity)
+    finally:
+        # types that failed keep their previous entry (or none), so they are rendered again
+        done = set(rendered) | set(skipped)
+        write_manifest(out_dir, {amenity: entry if amenity in done else previous[amenity]
+                                 for amenity, entry in maps.items()
+                                 if amenity in done or amenity in previous})
+
+    return {'rendered': sorted(rendered), 'skipped': skipped, 'removed': removed}
+
+def main(json_path, out_dir=None, processes=None):
+    start = time.perf_counter()
+    data, _ = st.load_amenities(json_path)
+    result = render_all(data, out_dir, processes)
+    print(f"{len(result['rendered'])} maps rendered, {len(result['skipped'])} unchanged, "
+          f"{len(result['removed'])} removed in {time.perf_counter() - start:.1f} s "
+          f"({out_dir or MAP_DIR})")
+
+if __name__ == '__main__':
+    # python3 -m core.map_batch <amenities .json.gz> [output folder] [processes]
+    main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None,
+         int(sys.argv[3]) if len(sys.argv) > 3 else None)
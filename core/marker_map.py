@@ -0,0 +1,134 @@
+# Description:
+#   Fast folium maps of many places. All the points go into the page as one
+#   compact JSON array ([lat, lon, popup text] per place) and the markers are
+#   created and clustered in the browser (FastMarkerCluster) with one shared
+#   icon, instead of one folium.Marker + Icon object per place in Python.
+#
+#   Benchmark against the per-marker maps (from the repository root):
+#       python3 -m core.marker_map [number of markers ...]
+
+import sys
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import folium
+from folium.plugins import FastMarkerCluster, MarkerCluster
+from core import amenity_stream as sm
+
+# decimals kept for lat / lon in the page (6 decimals is about 0.1 m)
+COORD_DECIMALS = 6
+BENCHMARK_SIZES = [1_000, 10_000, 100_000]
+# the per-marker map is only timed up to this many markers (it takes minutes at 100k)
+BENCHMARK_MARKER_LIMIT = 10_000
+
+# callback of FastMarkerCluster (a function expression): row is [lat, lon, text],
+# one icon shared by every marker
+_CALLBACK = """(function () {
+    var icon = L.AwesomeMarkers.icon(%s);
+    return function (row) {
+        var popup = document.createElement('div');
+        popup.textContent = row[2];
+        return L.marker(new L.LatLng(row[0], row[1]), {icon: icon}).bindPopup(popup);
+    };
+})()"""
+
+def icon_options(color='red', icon='info-sign', prefix='glyphicon'):
+    """
+    Options of L.AwesomeMarkers.icon, same defaults as folium.Icon
+    """
+    return {'markerColor': color, 'iconColor': 'white', 'icon': icon, 'prefix': prefix}
+
+def popup_texts(data):
+    """
+    Popup text of every row of data: 'name (amenity)'
+    """
+    return [f'{name} ({amenity})' for name, amenity in zip(data['name'], data['amenity'])]
+
+def points(data):
+    """
+    [lat, lon, popup text] of every row of data, coordinates rounded to COORD_DECIMALS
+    """
+    lat = np.round(data['lat'].to_numpy(dtype=np.float64), COORD_DECIMALS).tolist()
+    lon = np.round(data['lon'].to_numpy(dtype=np.float64), COORD_DECIMALS).tolist()
+    return [list(row) for row in zip(lat, lon, popup_texts(data))]
+
+def add_points(m, data, icon=None):
+    """
+    Add a client-side clustered marker layer with every row of data to the map m
+        @param icon: icon_options(...) (default: red info sign)
+    """
+    callback = _CALLBACK % json.dumps(icon or icon_options())
+    return FastMarkerCluster(points(data), callback=callback).add_to(m)
+
+def points_map(data, icon=None):
+    """
+    Map centered on the mean position of data with one clustered marker per row
+        @param data: DataFrame with 'lat', 'lon', 'name' and 'amenity' columns
+        @param icon: icon_options(...) (default: red info sign)
+    """
+    m = folium.Map(location = [data['lat'].mean(), data['lon'].mean()], zoom_start = 10)
+    add_points(m, data, icon)
+    return m
+
+def marker_map(data, icon=None):
+    """
+    Same map with one folium.Marker per row (the former make_map), for the benchmark
+    """
+    icon = icon or icon_options()
+    m = folium.Map(location = [data['lat'].mean(), data['lon'].mean()], zoom_start = 10)
+    marker = MarkerCluster().add_to(m)
+
+    for _, row in data.iterrows():
+        name = row['name']
+        text = f'{name} ({row['amenity']})'
+        folium.Marker(
+            location = [row['lat'], row['lon']],
+            popup = text,
+            icon = folium.Icon(color = icon['markerColor'], icon = icon['icon'], prefix = icon['prefix'])
+        ).add_to(marker)
+
+    return m
+
+def random_places(n, seed=0):
+    """
+    n random places in the Vancouver box, shaped like the amenity data
+    """
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = sm.VANCOUVER_BBOX
+    return pd.DataFrame({
+        'lat': rng.uniform(min_lat, max_lat, n),
+        'lon': rng.uniform(min_lon, max_lon, n),
+        'name': [f'Place {i}' for i in range(n)],
+        'amenity': rng.choice(['cafe', 'restaurant', 'bench', 'pub'], n),
+    })
+
+def render(build, data):
+    """
+    Build a map and its HTML
+        @return (seconds, HTML size in bytes)
+    """
+    start = time.perf_counter()
+    html = build(data).get_root().render()
+    return time.perf_counter() - start, len(html.encode('utf-8'))
+
+def benchmark(sizes=None, marker_limit=BENCHMARK_MARKER_LIMIT):
+    """
+    Print render time and HTML size of points_map and marker_map for every size
+    """
+    print(f"{'markers':>8} {'fast s':>8} {'fast MB':>8} {'marker s':>9} {'marker MB':>9}")
+    for n in sizes or BENCHMARK_SIZES:
+        data = random_places(n)
+        fast_s, fast_size = render(points_map, data)
+        line = f"{n:>8} {fast_s:>8.2f} {fast_size / 1e6:>8.2f}"
+        if n <= marker_limit:
+            marker_s, marker_size = render(marker_map, data)
+            line += f" {marker_s:>9.2f} {marker_size / 1e6:>9.2f}"
+        else:
+            line += f" {'-':>9} {'-':>9}"
+        print(line)
+
+if __name__ == '__main__':
+    # python3 -m core.marker_map [number of markers ...]
+    benchmark([int(n) for n in sys.argv[1:]] or None)
@@ -0,0 +1,146 @@
+# Description:
+#   Spark-free, multi-core replacement for code/osm-amenities.py.
+#   Reads the line-by-line XML fragment files written by code/disassemble-osm.py
+#   with a process pool (one file per task), skips every line that cannot be an
+#   amenity node before any XML parsing, and writes the amenity nodes as
+#   JSON lines and Parquet (lat, lon, timestamp, amenity, name, id, tags).
+#   The OSM node id is kept so change files can be applied later (see osm_update.py).
+#
+#   Typical invocation (from the repository root):
+#       python3 -m core.osm_extract 'osm-planet-*.xml.gz' amenities
+
+import os
+import sys
+import glob
+import gzip
+import time
+import datetime
+import multiprocessing
+from xml.etree import ElementTree
+
+import pandas as pd
+
+from core import amenity_stream as sm
+
+def fragment_files(path):
+    """
+    Fragment files of path: the file itself, the .xml / .xml.gz files of a directory, or a glob pattern
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(('.xml', '.xml.gz'))]
+    elif os.path.exists(path):
+        files = [path]
+    else:
+        files = sorted(glob.glob(path))
+    if not files:
+        raise FileNotFoundError(path)
+    return files
+
+def iso_timestamp(text):
+    """
+    OSM timestamp -> ISO 8601 UTC string with milliseconds (the format Spark writes),
+    e.g. '2020-03-21T01:22:12Z' -> '2020-03-21T01:22:12.000Z'.
+    The fixed 'YYYY-MM-DDTHH:MM:SSZ' format OSM uses is handled by slicing;
+    anything else goes through datetime.fromisoformat.
+    """
+    if (len(text) == 20 and text[19] == 'Z' and text[10] == 'T'
+            and text[4] == text[7] == '-' and text[13] == text[16] == ':'
+            and text[:4].isdigit() and text[5:7].isdigit() and text[8:10].isdigit()
+            and text[11:13].isdigit() and text[14:16].isdigit() and text[17:19].isdigit()):
+        return text[:19] + '.000Z'
+    when = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    when = when.astimezone(datetime.timezone.utc)
+    return when.strftime('%Y-%m-%dT%H:%M:%S.') + f"{when.microsecond // 1000:03d}Z"
+
+def get_amenity(line):
+    """
+    Amenity record of one XML fragment line, or None
+    (same fields as code/osm-amenities.py plus the OSM node id)
+    """
+    root = ElementTree.fromstring(line)
+    if root.tag != 'node':
+        return None
+
+    tags = {tag.get('k'): tag.get('v') for tag in root.iter('tag')}
+    if 'amenity' not in tags:
+        return None
+
+    amenity = tags.pop('amenity')
+    name = tags.pop('name', None)
+    return {
+        'lat': float(root.get('lat')),
+        'lon': float(root.get('lon')),
+        'timestamp': iso_timestamp(root.get('timestamp')),
+        'amenity': amenity,
+        'name': name,
+        'id': int(root.get('id')),
+        'tags': tags,
+    }
+
+def extract_file(path):
+    """
+    Amenity records of one fragment file
+        @return (path, records, number of nodes scanned)
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    records = []
+    nodes = 0
+    with opener(path, 'rb') as f:
+        for line in f:
+            if not line.startswith(b'<node'):
+                continue
+            nodes += 1
+            # cheap byte test first: most nodes have no tags at all
+            if b'amenity' not in line:
+                continue
+            record = get_amenity(line)
+            if record is not None:
+                records.append(record)
+    return path, records, nodes
+
+def extract(inputs, processes=None):
+    """
+    Yield (path, DataFrame of amenity records, nodes scanned) for every fragment file,
+    in input order, parsed in a process pool
+    """
+    columns = ['lat', 'lon', 'timestamp', 'amenity', 'name', 'id', 'tags']
+    files = fragment_files(inputs)
+    with multiprocessing.Pool(processes) as pool:
+        for path, records, nodes in pool.imap(extract_file, files):
+            yield path, pd.DataFrame(records, columns=columns), nodes
+
+def main(inputs, output, processes=None):
+    """
+    Write output + '.json.gz' and output + '.parquet' and report the throughput
+    """
+    from pyarrow import parquet
+
+    schema = sm.parquet_schema()
+    json_path, parquet_path = output + '.json.gz', output + '.parquet'
+    start = time.perf_counter()
+    total_nodes = total_amenities = 0
+
+    with sm.open_json_lines(json_path + '.tmp', True) as json_file, \
+            parquet.ParquetWriter(parquet_path + '.tmp', schema) as parquet_writer:
+        for path, chunk, nodes in extract(inputs, processes):
+            json_file.writelines(sm.json_lines(chunk))
+            if len(chunk):
+                parquet_writer.write_table(sm.parquet_table(chunk, schema))
+
+            total_nodes += nodes
+            total_amenities += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"{os.path.basename(path)}: {nodes} nodes, {len(chunk)} amenities "
+                  f"({total_nodes / elapsed:,.0f} nodes/s so far)")
+
+    os.replace(json_path + '.tmp', json_path)
+    os.replace(parquet_path + '.tmp', parquet_path)
+    elapsed = time.perf_counter() - start
+    print(f"{total_amenities} amenities from {total_nodes} nodes in {elapsed:.1f}s "
+          f"({total_nodes / max(elapsed, 1e-9):,.0f} nodes/s)")
+
+if __name__ == '__main__':
+    # python3 -m core.osm_extract <fragment file / directory / glob> <output prefix> [processes]
+    main(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else None)
@@ -0,0 +1,235 @@
+# Description:
+#   Incremental amenity updates from OSM change files (osmChange, .osc / .osc.gz).
+#   Node create / modify / delete are applied to the loaded data and, in place,
+#   to the spatial index and the theme ranking; only the new rows are scored.
+#   A change only replaces a row when its timestamp is newer.
+#
+#   Changes are matched to rows by OSM node id. core.osm_extract keeps the id, and
+#   core.amenity_stream and the amenity store pass it through. Data from the Spark
+#   scripts in code/ (such as the shipped amenities-vancouver.json.gz) has no id,
+#   so its rows can only be matched by exact (lat, lon). For those rows, a modify
+#   that moves the node is counted as created and leaves the old row in place, and
+#   a delete without lat / lon is ignored. Re-extract with core.osm_extract to
+#   avoid this.
+#
+#   Hand-written change files (with the expected stats) are in fixtures/osm_update/.
+#
+#   Update the amenity store of a JSON file (from the repository root):
+#       python3 -m core.osm_update amenities-vancouver.json.gz changes.osc [more.osc ...]
+
+import os
+import sys
+import gzip
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+
+from core import data_cleaning as dc
+from core import interesting_place as ip
+from core import amenity_store as st
+from core import amenity_stream as sm
+from core import osm_extract as ox
+
+ACTIONS = ('create', 'modify', 'delete')
+CHANGE_COLUMNS = ['action', 'id', 'version', 'lat', 'lon', 'timestamp', 'tags']
+
+def read_changes(path):
+    """
+    Node changes of an osmChange file, in file order
+        @return DataFrame with CHANGE_COLUMNS, tags as dicts (amenity / name included);
+            deleted nodes may have no lat / lon
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    rows = []
+    action = None
+    with opener(path, 'rb') as f:
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in ACTIONS:
+                    action = elem.tag
+                continue
+
+            if elem.tag == 'node' and action is not None:
+                lat, lon = elem.get('lat'), elem.get('lon')
+                rows.append({
+                    'action': action,
+                    'id': int(elem.get('id')),
+                    'version': int(elem.get('version', 0)),
+                    'lat': float(lat) if lat is not None else np.nan,
+                    'lon': float(lon) if lon is not None else np.nan,
+                    'timestamp': ox.iso_timestamp(elem.get('timestamp')),
+                    'tags': {tag.get('k'): tag.get('v') for tag in elem.iter('tag')},
+                })
+            if elem.tag in ACTIONS:
+                action = None
+            if elem.tag in ('node', 'way', 'relation') or elem.tag in ACTIONS:
+                elem.clear()
+    return pd.DataFrame(rows, columns=CHANGE_COLUMNS)
+
+def latest_changes(changes):
+    """
+    Last change of every node: newest timestamp, then highest version, then file order
+    """
+    order = changes.assign(
+        _time=pd.to_datetime(changes['timestamp'], utc=True, format='ISO8601'),
+        _seq=np.arange(len(changes)),
+    ).sort_values(['_time', 'version', '_seq'], kind='stable')
+    return order.drop_duplicates('id', keep='last').sort_values('_seq').drop(columns=['_time', '_seq'])
+
+def _in_bbox(lat, lon, bbox):
+    if bbox is None:
+        return True
+    min_lat, max_lat, min_lon, max_lon = bbox
+    return min_lat < lat < max_lat and min_lon < lon < max_lon
+
+def _new_rows(records, data, tags, start_label):
+    """
+    DataFrame of the added amenities shaped like data (categorical amenity kept)
+        @param tags: TagTable of data, None if data has a 'tags' dict column
+        @return (new rows, tags with the new rows appended)
+    """
+    new = pd.DataFrame(records, columns=['lat', 'lon', 'timestamp', 'amenity', 'name', 'id', 'tags'],
+                       index=pd.RangeIndex(start_label, start_label + len(records)))
+    new['id'] = new['id'].astype('Int64')
+
+    if tags is not None:
+        new_tags = list(new['tags'])
+        new = new.drop(columns=['tags']).assign(
+            tag_row=np.arange(len(tags), len(tags) + len(new), dtype=np.int64),
+            tag_count=np.array([len(t) for t in new_tags], dtype=np.int32),
+            has_wikipedia=np.array(['wikipedia' in t for t in new_tags], dtype=bool),
+            has_wikidata=np.array(['wikidata' in t for t in new_tags], dtype=bool),
+        )
+        tags = tags.append(new_tags)
+
+    if isinstance(data['amenity'].dtype, pd.CategoricalDtype):
+        categories = data['amenity'].dtype.categories
+        missing = pd.Index(new['amenity'].unique()).difference(categories)
+        new['amenity'] = pd.Categorical(new['amenity'], categories=categories.append(missing))
+
+    if 'hidden_score' in data:
+        new['hidden_score'] = ip.calc_scores(new)
+    return new, tags
+
+def apply_changes(data, changes, tags=None, index=None, ranking=None, bbox=None):
+    """
+    Apply node changes (see read_changes) to cleaned amenity data.
+
+    A change is matched to a row by node id, or by its (lat, lon) for rows
+    without an id (see the module description); it is applied only if its
+    timestamp is newer than the row's. Created / modified nodes with an
+    amenity tag (inside bbox) become rows at the end of the data, with new
+    labels; the replaced and deleted rows are dropped, the other labels stay
+    the same.
+    When two amenities end up at the same position, the newer one is kept.
+
+        @param tags: TagTable of data (see amenity_store.load_amenities),
+            None if data has a 'tags' dict column
+        @param index: SpatialIndex built over data, updated in place
+        @param ranking: ThemeRanking over data's labels, updated in place
+        @param bbox: (min lat, max lat, min lon, max lon), nodes outside are not added
+        @return (updated data, its TagTable (None without tags),
+            counts of created / modified / deleted / stale changes)
+    """
+    stats = {'created': 0, 'modified': 0, 'deleted': 0, 'stale': 0, 'ignored': 0}
+    if 'id' in data:
+        data = data.assign(id=data['id'].astype('Int64'))
+        ids = data['id'].to_numpy(dtype=np.float64, na_value=np.nan)
+    else:
+        ids = np.full(len(data), np.nan)
+
+    labels = data.index.to_numpy()
+    by_id = {int(i): label for i, label in zip(ids, labels) if not np.isnan(i)}
+    by_position = dict(zip(zip(data['lat'].to_numpy(), data['lon'].to_numpy()), labels))
+    without_id = set(labels[np.isnan(ids)])
+
+    def row_time(label):
+        return pd.Timestamp(data.at[label, 'timestamp']).tz_convert('UTC')
+
+    removed = set()
+    added = {}
+    for change in latest_changes(changes).itertuples(index=False):
+        time = pd.Timestamp(change.timestamp).tz_convert('UTC')
+        position = (change.lat, change.lon)
+
+        label = by_id.get(change.id)
+        if label is None and position in by_position and by_position[position] in without_id:
+            label = by_position[position]
+        if label in removed:
+            label = None
+        if label is not None and row_time(label) >= time:
+            stats['stale'] += 1
+            continue
+
+        node_tags = dict(change.tags)
+        amenity = node_tags.pop('amenity', None)
+        name = node_tags.pop('name', None)
+        if (change.action == 'delete' or amenity is None or np.isnan(change.lat)
+                or not _in_bbox(change.lat, change.lon, bbox)):
+            if label is None:
+                stats['ignored'] += 1
+            else:
+                removed.add(label)
+                stats['deleted'] += 1
+            continue
+
+        # another amenity already at this position: the newer one wins
+        other = by_position.get(position)
+        if other is not None and other != label and other not in removed:
+            if row_time(other) >= time:
+                stats['stale'] += 1
+                continue
+            removed.add(other)
+        if position in added and pd.Timestamp(added[position]['timestamp']) >= time:
+            stats['stale'] += 1
+            continue
+
+        if label is not None:
+            removed.add(label)
+        stats['modified' if label is not None else 'created'] += 1
+        added[position] = {'lat': change.lat, 'lon': change.lon, 'timestamp': change.timestamp,
+                           'amenity': amenity, 'name': name, 'id': change.id, 'tags': node_tags}
+
+    keep = ~data.index.isin(list(removed))
+    start_label = int(data.index.max()) + 1 if len(data) else 0
+    new, tags = _new_rows(list(added.values()), data, tags, start_label)
+
+    kept = data[keep]
+    if isinstance(new['amenity'].dtype, pd.CategoricalDtype):
+        kept = kept.assign(amenity=kept['amenity'].cat.set_categories(new['amenity'].dtype.categories))
+    result = pd.concat([kept, new])
+    result['id'] = result['id'].astype('Int64')
+
+    if index is not None:
+        index.update(keep, new['lat'].to_numpy(), new['lon'].to_numpy())
+    if ranking is not None:
+        ranking.remove([label for label in removed if label in ranking])
+        ranking.add(new[new['amenity'].isin(dc.INTERESTING_AMENITIES)])
+    return result, tags, stats
+
+def update_store(json_path, osc_paths, store_dir=None, bbox=None):
+    """
+    Apply change files to the amenity store of json_path (built first if needed).
+    Files already applied (by name, see the store metadata) are skipped.
+    Rebuilding the store from the JSON file (refresh) drops the updates.
+    """
+    data, tags = st.load_amenities(json_path, store_dir)
+    applied = (st.read_meta(json_path, store_dir) or {}).get('updates', [])
+
+    for path in osc_paths:
+        name = os.path.basename(path)
+        if name in applied:
+            print(f"{name}: already applied")
+            continue
+        data, tags, stats = apply_changes(data, read_changes(path), tags, bbox=bbox)
+        applied.append(name)
+        print(f"{name}: " + ", ".join(f"{count} {kind}" for kind, count in stats.items()))
+
+    st.write_store(data, tags, json_path, store_dir, updates=applied)
+    return data, tags
+
+if __name__ == '__main__':
+    # python3 -m core.osm_update <amenities .json.gz> <change .osc / .osc.gz> [...]
+    # nodes outside the Vancouver box of code/just-vancouver.py are not added
+    update_store(sys.argv[1], sys.argv[2:], bbox=sm.VANCOUVER_BBOX)
@@ -0,0 +1,548 @@
+# Description:
+#   Compact array-backed road graph (CSR) with a Dijkstra shortest path search.
+#   Built once from the osmnx MultiDiGraph; routing never touches networkx afterwards.
+
+import os
+import json
+import math
+import heapq
+import shutil
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components, dijkstra as csgraph_dijkstra
+from scipy.spatial import cKDTree
+
+ROAD_GRAPH_VERSION = 1
+_ARRAYS = ('node_ids', 'lat', 'lon', 'indptr', 'indices', 'lengths')
+# reverse adjacency and ALT landmark tables, saved only when built
+_OPTIONAL_ARRAYS = ('rev_indptr', 'rev_indices', 'rev_lengths', 'landmarks', 'landmark_from', 'landmark_to',
+                    'weak_labels', 'strong_labels')
+
+# great-circle lower bound for A*; slightly below osmnx's 6371009 m so the
+# heuristic stays admissible with float32 edge lengths
+HEURISTIC_EARTH_RADIUS_M = 6_371_000
+
+def _round_down(distances):
+    """
+    float32 copy of distances, finite values rounded down to the next smaller float
+    (so they never overestimate), inf kept as inf
+    """
+    distances = np.array(distances, dtype=np.float32)
+    return np.where(np.isinf(distances), np.float32(np.inf), np.nextafter(distances, np.float32(0)))
+
+class RoadGraph:
+    """
+    Directed road network stored as CSR arrays.
+
+    Nodes are numbered 0..n-1 in increasing OSM id order:
+        node_ids[i]                    OSM id of node i (int64)
+        lat[i], lon[i]                 node coordinates (float64)
+    Out-edges of node i are slots indptr[i]:indptr[i + 1] of
+        indices                        target node (int32)
+        lengths                        edge length in meters (float32)
+    Parallel edges are merged keeping the shortest one, as networkx does
+    when routing a MultiDiGraph with weight='length'.
+    """
+
+    def __init__(self, node_ids, lat, lon, indptr, indices, lengths):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        for name in _OPTIONAL_ARRAYS:
+            setattr(self, name, None)
+        self._reset_caches()
+
+    def _reset_caches(self):
+        self._main_nodes = None
+        self._main_kdtree = None
+        self._views = None
+        self._reverse_views = None
+        self._landmark_views = None
+        self._radians = None
+        self._kdtree = None
+
+    @classmethod
+    def from_networkx(cls, G, weight='length'):
+        """
+        Convert an osmnx graph (nodes with 'x' / 'y', edges with weight)
+        """
+        node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        node_ids.sort()
+        lat = np.array([G.nodes[n]['y'] for n in node_ids.tolist()], dtype=np.float64)
+        lon = np.array([G.nodes[n]['x'] for n in node_ids.tolist()], dtype=np.float64)
+
+        m = G.number_of_edges()
+        u = np.empty(m, dtype=np.int64)
+        v = np.empty(m, dtype=np.int64)
+        w = np.empty(m, dtype=np.float64)
+        for i, (a, b, length) in enumerate(G.edges(data=weight, default=1)):
+            u[i], v[i], w[i] = a, b, length
+        u = np.searchsorted(node_ids, u)
+        v = np.searchsorted(node_ids, v)
+
+        # drop self loops, keep the shortest of parallel edges
+        keep = u != v
+        u, v, w = u[keep], v[keep], w[keep]
+        order = np.lexsort((w, v, u))
+        u, v, w = u[order], v[order], w[order]
+        first = np.ones(len(u), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        u, v, w = u[first], v[first], w[first]
+
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(u, minlength=len(node_ids)), out=indptr[1:])
+        return cls(node_ids, lat, lon, indptr, v, w)
+
+    def save(self, path, **meta):
+        """
+        Write the arrays as flat .npy files in the directory path (plus meta.json).
+        The directory is replaced atomically-ish: written under a temp name, then renamed.
+            @param meta: extra JSON-able metadata (e.g. the source graph checksum)
+        """
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in _ARRAYS + _OPTIONAL_ARRAYS:
+            if getattr(self, name) is not None:
+                np.save(os.path.join(tmp, name + '.npy'), getattr(self, name))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'version': ROAD_GRAPH_VERSION, 'nodes': len(self), 'edges': self.n_edges, **meta}, f, indent=2)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def read_meta(path):
+        """
+        meta.json of a saved graph, None if missing / unreadable / other version
+        """
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('version') == ROAD_GRAPH_VERSION else None
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a graph written by save.
+        With mmap=True the arrays are read-only memory maps: every process that loads
+        the same directory shares the pages through the OS page cache (zero-copy),
+        so many planner processes cost the graph's RAM only once. Put the directory on
+        /dev/shm to keep it in a shared-memory filesystem.
+        """
+        meta = cls.read_meta(path)
+        if meta is None:
+            raise FileNotFoundError(f"No road graph in {path}")
+
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in _ARRAYS}
+        for name in _OPTIONAL_ARRAYS:
+            file = os.path.join(path, name + '.npy')
+            arrays[name] = np.load(file, mmap_mode=mode) if os.path.exists(file) else None
+        graph = cls.__new__(cls)
+        for name, array in arrays.items():
+            setattr(graph, name, array)
+        graph._reset_caches()
+
+        if len(graph.node_ids) != meta['nodes'] or len(graph.indices) != meta['edges']:
+            raise ValueError(f"Road graph in {path} does not match its metadata")
+        return graph
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.node_ids, self.lat, self.lon, self.indptr, self.indices, self.lengths))
+
+    @property
+    def signature(self):
+        """
+        Cheap fingerprint of the graph, to tell whether saved distances still apply
+        """
+        return f"{len(self.node_ids)}:{len(self.indices)}:{float(self.lengths.sum(dtype=np.float64)):.3f}"
+
+    def node_index(self, node_id):
+        """
+        Internal index of an OSM node id (KeyError if unknown)
+        """
+        i = int(np.searchsorted(self.node_ids, node_id))
+        if i == len(self.node_ids) or self.node_ids[i] != node_id:
+            raise KeyError(node_id)
+        return i
+
+    def route_ids(self, path):
+        """
+        OSM node ids of a path of internal indices
+        """
+        return self.node_ids[path].tolist()
+
+    def _unit_vectors(self, lats, lons):
+        lat = np.radians(np.asarray(lats, dtype=np.float64))
+        lon = np.radians(np.asarray(lons, dtype=np.float64))
+        return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+    @property
+    def kdtree(self):
+        """
+        KD-tree over the nodes as unit-sphere vectors, built on first use.
+        Chord length grows with great-circle distance, so the nearest vector
+        is the nearest node on the sphere.
+        """
+        if self._kdtree is None:
+            self._kdtree = cKDTree(self._unit_vectors(self.lat, self.lon))
+        return self._kdtree
+
+    def nearest_node(self, lat, lon, main_component=False):
+        """
+        Index of the node closest (great-circle) to (lat, lon)
+        """
+        return int(self.nearest_nodes([lat], [lon], main_component)[0])
+
+    def nearest_nodes(self, lats, lons, main_component=False, return_distance=False):
+        """
+        Vectorized nearest_node for arrays of points
+            @param main_component: only snap to nodes of the largest strongly connected
+                component, so every snapped pair has a route both ways
+            @param return_distance: also return the great-circle snap distances in meters
+            @return int64 array of node indices (, float64 array of meters)
+        """
+        vectors = self._unit_vectors(lats, lons)
+        if main_component:
+            if self._main_kdtree is None:
+                self._main_nodes = np.flatnonzero(self.strong_components() == self.main_component())
+                self._main_kdtree = cKDTree(self._unit_vectors(self.lat[self._main_nodes], self.lon[self._main_nodes]))
+            chord, idx = self._main_kdtree.query(vectors)
+            idx = self._main_nodes[idx]
+        else:
+            chord, idx = self.kdtree.query(vectors)
+
+        idx = np.asarray(idx, dtype=np.int64)
+        if not return_distance:
+            return idx
+        return idx, 2 * HEURISTIC_EARTH_RADIUS_M * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+    # ==============================================================
+    # Connected components
+    # ==============================================================
+
+    def build_components(self):
+        """
+        Label weakly and strongly connected components (saved with the graph by save()).
+        Nodes in different weak components can never reach each other.
+        """
+        matrix = self._matrix()
+        _, self.weak_labels = connected_components(matrix, directed=True, connection='weak')
+        _, self.strong_labels = connected_components(matrix, directed=True, connection='strong')
+        self.weak_labels = self.weak_labels.astype(np.int32)
+        self.strong_labels = self.strong_labels.astype(np.int32)
+        self._main_nodes = self._main_kdtree = None
+        return self
+
+    def weak_components(self):
+        if self.weak_labels is None:
+            self.build_components()
+        return self.weak_labels
+
+    def strong_components(self):
+        if self.strong_labels is None:
+            self.build_components()
+        return self.strong_labels
+
+    def main_component(self):
+        """
+        Label of the largest strongly connected component
+        """
+        return int(np.argmax(np.bincount(self.strong_components())))
+
+    def maybe_reachable(self, source, target):
+        """
+        False when target can certainly not be reached from source (different weak
+        components); True otherwise (certain when both share a strong component)
+        """
+        weak = self.weak_components()
+        return bool(weak[source] == weak[target])
+
+    def _adjacency(self):
+        # memoryviews give fast scalar access from Python without copying the arrays
+        if self._views is None:
+            self._views = (memoryview(self.indptr), memoryview(self.indices), memoryview(self.lengths))
+        return self._views
+
+    def shortest_path(self, source, target):
+        """
+        Dijkstra from source to target (internal indices), stops once target is settled
+            @return (length in meters, list of node indices) or (None, None) if unreachable
+        """
+        if not self.maybe_reachable(source, target):
+            return None, None
+
+        indptr, indices, lengths = self._adjacency()
+        inf = float('inf')
+        dist = {source: 0.0}
+        pred = {source: -1}
+        heap = [(0.0, source)]
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u == target:
+                path = [u]
+                while pred[path[-1]] != -1:
+                    path.append(pred[path[-1]])
+                return d, path[::-1]
+
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + lengths[e]
+                if nd < dist.get(v, inf):
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(heap, (nd, v))
+
+        return None, None
+
+    def distances_to(self, source, targets):
+        """
+        One-to-many Dijkstra: distances from source to every target (internal indices).
+        The search stops as soon as all targets are settled.
+            @return float64 array aligned with targets, inf where unreachable
+        """
+        indptr, indices, lengths = self._adjacency()
+        inf = float('inf')
+        # targets in another weak component stay inf without being searched for
+        weak = self.weak_components()
+        pending = {t for t in targets if weak[t] == weak[source]}
+        settled = {}
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+
+        while heap and pending:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u in pending:
+                pending.discard(u)
+                settled[u] = d
+
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + lengths[e]
+                if nd < dist.get(v, inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+
+        return np.array([settled.get(t, inf) for t in targets], dtype=np.float64)
+
+    # ==============================================================
+    # Goal-directed point-to-point search (bidirectional A* / ALT)
+    # ==============================================================
+
+    def build_reverse(self):
+        """
+        CSR of the reversed edges (in-edges of every node), needed by the backward search
+        """
+        if self.rev_indptr is None:
+            sources = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind='stable')
+            self.rev_indices = sources[order]
+            self.rev_lengths = self.lengths[order]
+            self.rev_indptr = np.zeros(len(self) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=len(self)), out=self.rev_indptr[1:])
+            self._reverse_views = None
+        return self
+
+    def _matrix(self):
+        return sp.csr_matrix((self.lengths.astype(np.float64), self.indices, self.indptr), shape=(len(self), len(self)))
+
+    def build_landmarks(self, k=8, seed=0):
+        """
+        Precompute the ALT landmark tables with farthest-point landmark selection:
+            landmark_from[i][v] = d(landmarks[i], v),  landmark_to[i][v] = d(v, landmarks[i])
+        (float32 meters, inf where unreachable). Saved with the graph by save().
+        """
+        matrix = self._matrix()
+        transposed = matrix.T.tocsr()
+        rng = np.random.default_rng(seed)
+
+        landmarks, dist_from, dist_to = [], [], []
+        closest = None
+        candidate = int(rng.integers(len(self)))
+        for _ in range(min(k, len(self))):
+            landmarks.append(candidate)
+            dist_from.append(csgraph_dijkstra(matrix, indices=candidate))
+            dist_to.append(csgraph_dijkstra(transposed, indices=candidate))
+
+            # next landmark: the reachable node farthest from every landmark so far
+            spread = dist_from[-1] + dist_to[-1]
+            spread[~np.isfinite(spread)] = -1
+            closest = spread if closest is None else np.minimum(closest, spread)
+            candidate = int(np.argmax(closest))
+            if closest[candidate] <= 0:
+                break
+
+        self.landmarks = np.array(landmarks, dtype=np.int32)
+        # round down so the stored distances never overestimate (keeps the bounds admissible)
+        # (unreachable stays inf: nextafter(inf, 0) would be FLT_MAX)
+        self.landmark_from = _round_down(dist_from)
+        self.landmark_to = _round_down(dist_to)
+        self._landmark_views = None
+        return self
+
+    def _search_views(self):
+        if self._reverse_views is None:
+            self.build_reverse()
+            self._reverse_views = (memoryview(self.rev_indptr), memoryview(self.rev_indices), memoryview(self.rev_lengths))
+        if self._radians is None:
+            self._radians = (memoryview(np.radians(self.lat)), memoryview(np.radians(self.lon)))
+        if self._landmark_views is None and self.landmarks is not None:
+            self._landmark_views = [
+                (memoryview(np.ascontiguousarray(f)), memoryview(np.ascontiguousarray(t)))
+                for f, t in zip(self.landmark_from, self.landmark_to)
+            ]
+        return self._adjacency(), self._reverse_views, self._radians, self._landmark_views or []
+
+    def shortest_path_bidirectional(self, source, target):
+        """
+        Exact point-to-point shortest path with bidirectional A*.
+        Both searches use the symmetric average potential p(v) = (h_t(v) - h_s(v)) / 2,
+        where h_t / h_s are lower bounds on d(v, target) / d(source, v): the great-circle
+        distance and, if build_landmarks was run, the ALT landmark bounds.
+            @return (length in meters, list of node indices) or (None, None) if unreachable
+        """
+        if source == target:
+            return 0.0, [source]
+        if not self.maybe_reachable(source, target):
+            return None, None
+
+        (indptr, indices, lengths), (rindptr, rindices, rlengths), (rlat, rlon), lms = self._search_views()
+        inf = float('inf')
+        asin, sin, cos, sqrt = math.asin, math.sin, math.cos, math.sqrt
+        diameter = 2 * HEURISTIC_EARTH_RADIUS_M
+
+        s_lat, s_lon, t_lat, t_lon = rlat[source], rlon[source], rlat[target], rlon[target]
+        cos_s, cos_t = cos(s_lat), cos(t_lat)
+        lm_bounds = [(f, to, f[source], to[source], f[target], to[target]) for f, to in lms]
+
+        potential = {}
+
+        def p(v):
+            # cached (h_t(v) - h_s(v)) / 2; inf if v cannot be on a source-target path
+            value = potential.get(v)
+            if value is None:
+                lat, lon = rlat[v], rlon[v]
+                cos_v = cos(lat)
+                a = sin((t_lat - lat) / 2) ** 2 + cos_v * cos_t * sin((t_lon - lon) / 2) ** 2
+                h_t = diameter * asin(min(1.0, sqrt(a)))
+                a = sin((lat - s_lat) / 2) ** 2 + cos_s * cos_v * sin((lon - s_lon) / 2) ** 2
+                h_s = diameter * asin(min(1.0, sqrt(a)))
+
+                # landmark bounds; nan (inf - inf) compares False and is skipped
+                for f, to, f_s, to_s, f_t, to_t in lm_bounds:
+                    f_v, to_v = f[v], to[v]
+                    if f_t - f_v > h_t:
+                        h_t = f_t - f_v
+                    if to_v - to_t > h_t:
+                        h_t = to_v - to_t
+                    if f_v - f_s > h_s:
+                        h_s = f_v - f_s
+                    if to_s - to_v > h_s:
+                        h_s = to_s - to_v
+
+                value = inf if h_t == inf or h_s == inf else (h_t - h_s) / 2
+                potential[v] = value
+            return value
+
+        dist = ({source: 0.0}, {target: 0.0})
+        pred = ({source: -1}, {target: -1})
+        settled = (set(), set())
+        heaps = ([(p(source), source)], [(-p(target), target)])
+        graphs = ((indptr, indices, lengths, 1), (rindptr, rindices, rlengths, -1))
+        best, meet = inf, -1
+
+        while heaps[0] and heaps[1]:
+            # keys are d(v) + p(v) forward and d(v) - p(v) backward, so the usual
+            # bidirectional stopping rule applies to them unchanged
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            key, u = heapq.heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+
+            d_u = dist[side][u]
+            other = dist[1 - side]
+            ptr, idx, lens, sign = graphs[side]
+            for e in range(ptr[u], ptr[u + 1]):
+                v = idx[e]
+                nd = d_u + lens[e]
+                if nd < dist[side].get(v, inf):
+                    p_v = p(v)
+                    if p_v == inf:
+                        continue
+                    dist[side][v] = nd
+                    pred[side][v] = u
+                    heapq.heappush(heaps[side], (nd + sign * p_v, v))
+                    if v in other and nd + other[v] < best:
+                        best, meet = nd + other[v], v
+
+        if meet == -1:
+            return None, None
+
+        path = [meet]
+        while pred[0][path[-1]] != -1:
+            path.append(pred[0][path[-1]])
+        path.reverse()
+        while pred[1][path[-1]] != -1:
+            path.append(pred[1][path[-1]])
+        return best, path
+
+def cross_check(G, R=None, n_pairs=200, seed=0, weight='length', tolerance=1e-3):
+    """
+    Compare the array-backed searches against networkx on random node pairs of G.
+        @param R: RoadGraph of G (converted if None); build_landmarks first to check ALT too
+        @return list of mismatches (source id, target id, networkx m, dijkstra m, bidirectional m);
+            empty when every length agrees within tolerance meters
+    """
+    import networkx as nx
+
+    R = R if R is not None else RoadGraph.from_networkx(G, weight)
+    rng = np.random.default_rng(seed)
+    mismatches = []
+    for s, t in rng.choice(R.node_ids, size=(n_pairs, 2)):
+        try:
+            expected = nx.shortest_path_length(G, int(s), int(t), weight=weight)
+        except nx.NetworkXNoPath:
+            expected = None
+
+        i, j = R.node_index(s), R.node_index(t)
+        plain, _ = R.shortest_path(i, j)
+        fast, path = R.shortest_path_bidirectional(i, j)
+        if path is not None:
+            # the returned route must really have the returned length
+            walked = sum(float(R.lengths[R.indptr[a] + np.flatnonzero(R.indices[R.indptr[a]:R.indptr[a + 1]] == b)[0]])
+                         for a, b in zip(path, path[1:]))
+            if abs(walked - fast) > tolerance:
+                fast = walked
+
+        results = (expected, plain, fast)
+        if expected is None:
+            ok = plain is None and fast is None
+        else:
+            ok = all(r is not None and abs(r - expected) <= tolerance for r in results[1:])
+        if not ok:
+            mismatches.append((int(s), int(t)) + results)
+    return mismatches
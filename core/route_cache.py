@@ -0,0 +1,110 @@
+# Description:
+#   Size-bounded LRU cache of routed distances, keyed by (mode, source node, target node).
+#   Can be saved to / loaded from a local file to reuse distances between runs.
+
+import os
+import pickle
+from collections import OrderedDict
+
+ROUTE_CACHE_VERSION = 1
+
+class RouteCache:
+    """
+    LRU mapping (mode, source OSM id, target OSM id) -> distance in meters.
+    inf is a valid value: it records that there is no route.
+    """
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """
+        Cached value (marked as most recently used) or None
+        """
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def save(self, path, signatures):
+        """
+        Write the entries (least recently used first) to path.
+            @param signatures: {mode: graph signature} the distances were computed on
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # keep what the file already has for modes not used in this session
+        previous = self._read(path)
+        kept_signatures = {mode: sig for mode, sig in previous['signatures'].items() if mode not in signatures}
+        items = [(key, value) for key, value in previous['items'] if key[0] in kept_signatures]
+        items += [(key, value) for key, value in self._items.items() if key[0] in signatures]
+
+        payload = {
+            'version': ROUTE_CACHE_VERSION,
+            'signatures': {**kept_signatures, **signatures},
+            'items': items,
+        }
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path, signatures):
+        """
+        Add the saved entries of the modes whose graph signature still matches.
+        Missing or unreadable files are ignored.
+            @return number of entries loaded
+        """
+        payload = self._read(path)
+        valid = {mode for mode, signature in payload['signatures'].items() if signatures.get(mode) == signature}
+        loaded = 0
+        for key, value in payload['items']:
+            if key[0] in valid and key not in self._items:
+                self.put(key, value)
+                loaded += 1
+        return loaded
+
+    def _read(self, path):
+        empty = {'version': ROUTE_CACHE_VERSION, 'signatures': {}, 'items': []}
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return empty
+        if not isinstance(payload, dict) or payload.get('version') != ROUTE_CACHE_VERSION:
+            return empty
+        return payload
@@ -0,0 +1,340 @@
+# Description:
+#   Lat/lon grid index for fast radius and k-nearest queries over amenities.
+#   Build it once over the cleaned data and share it between queries.
+
+import numpy as np
+
+R = 6371  # Earth r in km
+KM_PER_DEG_LAT = np.pi * R / 180
+
+# ~1.1 km cells, close to the 1-3 km radius used by the menu options
+DEFAULT_CELL_DEG = 0.01
+# km taken off the closest distance of a cell in query_best: clamping to the
+# cell's lat/lon box is off by well under a meter at this cell size
+CELL_DISTANCE_SLACK_KM = 0.001
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Vectorized great-circle distance in km (same formula as find_place.haversine)
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+class SpatialIndex:
+    """
+    Regular lat/lon grid over a set of points.
+
+    Points are bucketed into cells of cell_deg x cell_deg degrees and stored
+    sorted by cell key, so every grid row of a query window is one contiguous
+    slice found with searchsorted.
+    Query results are positions into the arrays the index was built from
+    (i.e. data.iloc positions), sorted by distance.
+    """
+
+    def __init__(self, lat, lon, cell_deg=DEFAULT_CELL_DEG):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_deg = cell_deg
+
+        # lon cells never wrap here, so keep one column per cell_deg of lon
+        self._n_cols = int(np.ceil(360 / cell_deg)) + 1
+
+        keys = self._cell_keys(self.lat, self.lon)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+        self._cells = None
+
+    @classmethod
+    def from_frame(cls, data, cell_deg=DEFAULT_CELL_DEG):
+        """
+        Build the index over the 'lat'/'lon' columns of a (cleaned) DataFrame
+        """
+        return cls(data['lat'].to_numpy(), data['lon'].to_numpy(), cell_deg)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _rows_cols(self, lat, lon):
+        rows = np.floor((np.asarray(lat) + 90) / self.cell_deg).astype(np.int64)
+        cols = np.floor((np.asarray(lon) + 180) / self.cell_deg).astype(np.int64)
+        return rows, cols
+
+    def _cell_keys(self, lat, lon):
+        rows, cols = self._rows_cols(lat, lon)
+        return rows * self._n_cols + cols
+
+    def _window(self, lat, radius_km):
+        """
+        Number of cell rows / cols to search around a query point at lat
+        """
+        dlat = radius_km / KM_PER_DEG_LAT
+        cos_lat = max(np.cos(np.radians(min(abs(lat) + dlat, 90))), 1e-12)
+        dlon = min(radius_km / (KM_PER_DEG_LAT * cos_lat), 180)
+        return int(np.ceil(dlat / self.cell_deg)), int(np.ceil(dlon / self.cell_deg))
+
+    def _candidates(self, lat, lon, radius_km):
+        row, col = self._rows_cols(lat, lon)
+        n_rows, n_cols = self._window(lat, radius_km)
+
+        row_keys = (row + np.arange(-n_rows, n_rows + 1)) * self._n_cols
+        starts = np.searchsorted(self._keys, row_keys + col - n_cols, side='left')
+        stops = np.searchsorted(self._keys, row_keys + col + n_cols, side='right')
+
+        if len(starts) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self._order[a:b] for a, b in zip(starts, stops)])
+
+    def query_radius(self, lat, lon, radius_km, mask=None):
+        """
+        Find all points within radius_km of (lat, lon)
+            @param mask: optional boolean array, only points with mask True are returned
+            @return (positions, distances) sorted by distance, ties by position
+        """
+        idx = self._candidates(lat, lon, radius_km)
+        if mask is not None:
+            idx = idx[np.asarray(mask)[idx]]
+        idx = np.sort(idx)
+
+        dist = haversine(lat, lon, self.lat[idx], self.lon[idx])
+        keep = dist <= radius_km
+        idx, dist = idx[keep], dist[keep]
+
+        order = np.argsort(dist, kind='stable')
+        return idx[order], dist[order]
+
+    def query_radius_batch(self, lats, lons, radius_km, mask=None, chunk_size=4096):
+        """
+        Find all points within radius_km of every query point in one vectorized pass
+            @param mask: optional boolean array, only points with mask True are returned
+            @param chunk_size: number of query points expanded at once (bounds memory)
+            @return CSR-style (offsets, positions, distances):
+                neighbours of query i are positions[offsets[i]:offsets[i + 1]],
+                sorted by distance, ties by position
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if mask is not None:
+            mask = np.asarray(mask)
+
+        query_ids, positions, distances = [], [], []
+        for lo in range(0, len(lats), chunk_size):
+            q, p, d = self._pairs_within(lats[lo:lo + chunk_size], lons[lo:lo + chunk_size], radius_km, mask)
+            query_ids.append(q + lo)
+            positions.append(p)
+            distances.append(d)
+
+        if query_ids:
+            query_ids = np.concatenate(query_ids)
+            positions = np.concatenate(positions)
+            distances = np.concatenate(distances)
+        else:
+            query_ids = positions = np.empty(0, dtype=np.int64)
+            distances = np.empty(0)
+
+        order = np.lexsort((positions, distances, query_ids))
+        offsets = np.zeros(len(lats) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(query_ids, minlength=len(lats)), out=offsets[1:])
+        return offsets, positions[order], distances[order]
+
+    def _pairs_within(self, lats, lons, radius_km, mask):
+        """
+        All (query, position, distance) pairs with distance <= radius_km, unordered
+        """
+        if len(lats) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+        rows, cols = self._rows_cols(lats, lons)
+        # one window for the whole chunk, sized for the query furthest from the equator
+        n_rows, n_cols = self._window(np.abs(lats).max(), radius_km)
+        query = np.arange(len(lats))
+
+        query_ids, positions = [], []
+        for dr in range(-n_rows, n_rows + 1):
+            row_keys = (rows + dr) * self._n_cols + cols
+            starts = np.searchsorted(self._keys, row_keys - n_cols, side='left')
+            stops = np.searchsorted(self._keys, row_keys + n_cols, side='right')
+
+            # expand every [start, stop) slice into explicit (query, sorted slot) pairs
+            counts = stops - starts
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            firsts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            query_ids.append(np.repeat(query, counts))
+            positions.append(self._order[firsts + np.arange(total)])
+
+        if not query_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+        query_ids = np.concatenate(query_ids)
+        positions = np.concatenate(positions)
+        if mask is not None:
+            keep = mask[positions]
+            query_ids, positions = query_ids[keep], positions[keep]
+
+        distances = haversine(lats[query_ids], lons[query_ids], self.lat[positions], self.lon[positions])
+        keep = distances <= radius_km
+        return query_ids[keep], positions[keep], distances[keep]
+
+    def update(self, keep, lat, lon):
+        """
+        Drop the points where keep is False and append new points, in place.
+        Positions then match data[keep] followed by the new rows (same as
+        rebuilding the index), but the sorted cell order is only filtered and
+        merged with the new keys, not sorted again.
+            @param keep: boolean array over the current points
+            @param lat, lon: coordinates of the appended points
+        """
+        keep = np.asarray(keep, dtype=bool)
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+
+        # renumber the kept points, their relative order is unchanged
+        new_positions = np.cumsum(keep) - 1
+        kept = keep[self._order]
+        order = new_positions[self._order[kept]]
+        keys = self._keys[kept]
+
+        added_keys = self._cell_keys(lat, lon)
+        added_order = np.argsort(added_keys, kind='stable')
+        added_keys = added_keys[added_order]
+        # side='right': in a cell the new (higher) positions go after the kept ones
+        at = np.searchsorted(keys, added_keys, side='right')
+
+        self._keys = np.insert(keys, at, added_keys)
+        self._order = np.insert(order, at, int(np.count_nonzero(keep)) + added_order)
+        self._cells = None
+        self.lat = np.concatenate([self.lat[keep], lat])
+        self.lon = np.concatenate([self.lon[keep], lon])
+
+    def query_nearest(self, lat, lon, k=1, mask=None):
+        """
+        Find the k nearest points of (lat, lon)
+            @param mask: optional boolean array, only points with mask True are returned
+            @return (positions, distances) sorted by distance, ties by position
+        """
+        available = len(self) if mask is None else int(np.count_nonzero(mask))
+        k = min(k, available)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # grow the search radius until k points are inside it; everything
+        # closer than the k-th point is then guaranteed to be inside too
+        radius_km = self.cell_deg * KM_PER_DEG_LAT
+        while True:
+            idx, dist = self.query_radius(lat, lon, radius_km, mask)
+            if len(idx) >= k or radius_km > np.pi * R:
+                return idx[:k], dist[:k]
+            radius_km *= 2
+
+    def _occupied_cells(self):
+        """
+        (keys of the non-empty cells, start of every cell in the sorted order plus the end)
+        """
+        if self._cells is None:
+            keys, starts = np.unique(self._keys, return_index=True)
+            self._cells = keys, np.append(starts, len(self._keys))
+        return self._cells
+
+    def cell_maxima(self, values, mask=None):
+        """
+        Highest value of every non-empty cell (-inf if mask excludes all its points),
+        for query_best
+            @param values: array over the points
+        """
+        keys, starts = self._occupied_cells()
+        values = np.asarray(values, dtype=np.float64)
+        if mask is not None:
+            values = np.where(mask, values, -np.inf)
+        if len(keys) == 0:
+            return np.empty(0)
+        return np.maximum.reduceat(values[self._order], starts[:-1])
+
+    def _window_cells(self, lat, lon, radius_km):
+        """
+        Non-empty cells in the search window of a query (see _candidates)
+            @return (indexes into _occupied_cells, their grid rows, their grid cols)
+        """
+        keys, _ = self._occupied_cells()
+        row, col = self._rows_cols(lat, lon)
+        n_rows, n_cols = self._window(lat, radius_km)
+
+        row_keys = (row + np.arange(-n_rows, n_rows + 1)) * self._n_cols
+        starts = np.searchsorted(keys, row_keys + col - n_cols, side='left')
+        stops = np.searchsorted(keys, row_keys + col + n_cols, side='right')
+        counts = stops - starts
+        cells = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return cells, keys[cells] // self._n_cols, keys[cells] % self._n_cols
+
+    def _cell_distances(self, lat, lon, rows, cols):
+        """
+        Lower bound of the distance (km) from (lat, lon) to any point of the given cells
+        """
+        lat0 = rows * self.cell_deg - 90
+        lon0 = cols * self.cell_deg - 180
+        near_lat = np.clip(lat, lat0, lat0 + self.cell_deg)
+        near_lon = np.clip(lon, lon0, lon0 + self.cell_deg)
+        return np.maximum(haversine(lat, lon, near_lat, near_lon) - CELL_DISTANCE_SLACK_KM, 0)
+
+    def query_best(self, lat, lon, k, radius_km, score, distance_weight=1.0, cell_max=None, mask=None):
+        """
+        Find the k points within radius_km of (lat, lon) with the highest
+        value = score - distance_weight * distance (km).
+
+        Best-first search: the cells around the query are ranked by the best
+        value they could hold (their highest score at their closest distance)
+        and read in that order, in batches of 1, 2, 4, ... cells. It stops once
+        no cell left can beat the k-th value found, so the points read grow
+        with k, not with the number of points within the radius.
+            @param score: array over the points, higher is better
+            @param cell_max: cell_maxima(score, mask); pass it when querying many times
+            @param mask: optional boolean array, only points with mask True are returned
+            @return (positions, distances, values) best first, ties by distance then position
+        """
+        score = np.asarray(score, dtype=np.float64)
+        if cell_max is None:
+            cell_max = self.cell_maxima(score, mask)
+        if mask is not None:
+            mask = np.asarray(mask)
+        _, starts = self._occupied_cells()
+
+        positions = np.empty(0, dtype=np.int64)
+        distances = values = np.empty(0)
+        if k <= 0 or len(cell_max) == 0:
+            return positions, distances, values
+
+        cells, rows, cols = self._window_cells(lat, lon, radius_km)
+        cell_distances = self._cell_distances(lat, lon, rows, cols)
+        bounds = cell_max[cells] - distance_weight * cell_distances
+        keep = (cell_distances <= radius_km) & (bounds > -np.inf)
+        order = np.argsort(-bounds[keep], kind='stable')
+        cells, bounds = cells[keep][order], bounds[keep][order]
+
+        done, batch = 0, 1
+        while done < len(cells):
+            # strictly below: a tie could still win on distance / position
+            if len(positions) == k and bounds[done] < values[-1]:
+                break
+            lo, hi = starts[cells[done:done + batch]], starts[cells[done:done + batch] + 1]
+            done += batch
+            batch *= 2
+
+            counts = hi - lo
+            idx = self._order[np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())]
+            if mask is not None:
+                idx = idx[mask[idx]]
+            dist = haversine(lat, lon, self.lat[idx], self.lon[idx])
+            inside = dist <= radius_km
+            idx, dist = idx[inside], dist[inside]
+
+            positions = np.concatenate([positions, idx])
+            distances = np.concatenate([distances, dist])
+            values = np.concatenate([values, score[idx] - distance_weight * dist])
+            best = np.lexsort((positions, distances, -values))[:k]
+            positions, distances, values = positions[best], distances[best], values[best]
+
+        return positions, distances, values
@@ -0,0 +1,182 @@
+# Description:
+#   Compact storage of the OSM tags of every amenity.
+#   Keys and values are interned once and each row's tags are a slice of
+#   integer-coded key/value arrays (CSR layout), instead of one dict per row.
+#   The table is passed around next to its frame (e.g. load_amenities returns
+#   both, Dataset keeps it as .tags); rows find their tags by their 'tag_row'.
+
+import numpy as np
+import pandas as pd
+
+class TagTable:
+    """
+    Tags of n rows:
+        keys[key_codes[offsets[i]:offsets[i + 1]]] are the tag keys of row i,
+        values[value_codes[...]] the matching values.
+    Rows of a DataFrame refer to the table through their 'tag_row' column,
+    so filtered / reordered frames keep pointing at the right tags.
+    """
+
+    def __init__(self, offsets, key_codes, value_codes, keys, values):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.key_codes = np.asarray(key_codes, dtype=np.int32)
+        self.value_codes = np.asarray(value_codes, dtype=np.int32)
+        self.keys = list(keys)
+        self.values = list(values)
+        self._key_lookup = {key: code for code, key in enumerate(self.keys)}
+        self._value_lookup = None
+        self._entry_rows = None
+
+    @classmethod
+    def from_dicts(cls, tags):
+        """
+        Build from an iterable of tag dicts (anything else counts as no tags)
+        """
+        keys, values = {}, {}
+        offsets = [0]
+        key_codes, value_codes = [], []
+        for row in tags:
+            if isinstance(row, dict):
+                for key, value in row.items():
+                    key_codes.append(keys.setdefault(key, len(keys)))
+                    value_codes.append(values.setdefault(value, len(values)))
+            offsets.append(len(key_codes))
+        return cls(offsets, key_codes, value_codes, keys, values)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.key_codes.nbytes + self.value_codes.nbytes
+
+    def counts(self):
+        """
+        Number of tags of every row
+        """
+        return np.diff(self.offsets)
+
+    def entry_rows(self):
+        """
+        Row of every key/value entry
+        """
+        if self._entry_rows is None:
+            self._entry_rows = np.repeat(np.arange(len(self), dtype=np.int64), self.counts())
+        return self._entry_rows
+
+    def _rows_matching(self, entries):
+        found = np.zeros(len(self), dtype=bool)
+        found[self.entry_rows()[entries]] = True
+        return found
+
+    def has_key(self, key):
+        """
+        Boolean array: row has the tag key
+        """
+        code = self._key_lookup.get(key)
+        if code is None:
+            return np.zeros(len(self), dtype=bool)
+        return self._rows_matching(self.key_codes == code)
+
+    def has_tag(self, key, value):
+        """
+        Boolean array: row has key=value
+        """
+        if self._value_lookup is None:
+            self._value_lookup = {value: code for code, value in enumerate(self.values)}
+        key_code = self._key_lookup.get(key)
+        value_code = self._value_lookup.get(value)
+        if key_code is None or value_code is None:
+            return np.zeros(len(self), dtype=bool)
+        return self._rows_matching((self.key_codes == key_code) & (self.value_codes == value_code))
+
+    def append(self, tags):
+        """
+        New TagTable with the rows of this one followed by one row per tag dict
+        (existing rows keep their numbers, keys / values stay interned)
+        """
+        keys = {key: code for code, key in enumerate(self.keys)}
+        values = {value: code for code, value in enumerate(self.values)}
+        counts, key_codes, value_codes = [], [], []
+        for row in tags:
+            row = row if isinstance(row, dict) else {}
+            for key, value in row.items():
+                key_codes.append(keys.setdefault(key, len(keys)))
+                value_codes.append(values.setdefault(value, len(values)))
+            counts.append(len(row))
+
+        offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(counts, dtype=np.int64)])
+        return TagTable(offsets,
+                        np.concatenate([self.key_codes, np.asarray(key_codes, dtype=np.int32)]),
+                        np.concatenate([self.value_codes, np.asarray(value_codes, dtype=np.int32)]),
+                        keys, values)
+
+    def take(self, rows):
+        """
+        New TagTable with only the given rows, in that order (drops orphaned entries)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = self.counts()[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        # entry i of result row r comes from entry self.offsets[rows[r]] + (i - offsets[r])
+        entries = np.repeat(self.offsets[rows] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return TagTable(offsets, self.key_codes[entries], self.value_codes[entries], self.keys, self.values)
+
+    def row(self, i):
+        """
+        Tags of row i as a dict
+        """
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return {self.keys[k]: self.values[v] for k, v in zip(self.key_codes[lo:hi], self.value_codes[lo:hi])}
+
+    def to_dicts(self, rows=None):
+        """
+        Tags of the given rows (all rows by default) as a list of dicts
+        """
+        rows = range(len(self)) if rows is None else rows
+        return [self.row(i) for i in rows]
+
+def number_rows(data):
+    """
+    data with tag_row i on row i, for a table built from (or stored with) its rows in order
+    """
+    return data.assign(tag_row=np.arange(len(data), dtype=np.int64))
+
+def tag_counts(data, table=None):
+    """
+    Number of tags of every row of data, as a Series aligned with data.index
+        @param table: TagTable the 'tag_row' column of data refers to (else the 'tags' column is used)
+    """
+    if 'tag_count' in data:
+        return data['tag_count']
+    if table is not None:
+        return pd.Series(table.counts()[data['tag_row'].to_numpy()], index=data.index)
+    return data['tags'].map(lambda t: len(t) if isinstance(t, dict) else 0)
+
+def has_key(data, key, table=None):
+    """
+    Vectorized 'key in tags' for every row of data, as a boolean Series aligned with data.index
+        @param table: TagTable the 'tag_row' column of data refers to (else the 'tags' column is used)
+    """
+    if table is not None:
+        return pd.Series(table.has_key(key)[data['tag_row'].to_numpy()], index=data.index)
+    return data['tags'].map(lambda t: isinstance(t, dict) and key in t).astype(bool)
+
+def has_tag(data, key, value, table=None):
+    """
+    Vectorized 'tags.get(key) == value' for every row of data, as a boolean Series aligned with data.index
+        @param table: TagTable the 'tag_row' column of data refers to (else the 'tags' column is used)
+    """
+    if table is not None:
+        return pd.Series(table.has_tag(key, value)[data['tag_row'].to_numpy()], index=data.index)
+    return data['tags'].map(lambda t: isinstance(t, dict) and t.get(key) == value).astype(bool)
+
+def tags_of(data, table=None):
+    """
+    Tags of every row of data as a list of dicts
+        @param table: TagTable the 'tag_row' column of data refers to (else the 'tags' column is used)
+    """
+    if table is not None:
+        return table.to_dicts(data['tag_row'].to_numpy())
+    return [t if isinstance(t, dict) else {} for t in data['tags']]
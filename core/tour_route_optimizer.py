@@ -1,56 +1,447 @@
 # Description:
 #   Recommoned walking path based on the closest distance from the current location (picture).
 
+import os
+import re
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import threading
+
 import numpy as np
 import pandas as pd
 
-import osmnx as ox
-import networkx as nx
+from core import road_graph as rg
+from core import route_cache as rc
+
+PLACE = "Metro Vancouver, British Columbia, Canada"
+
+# on-disk graph cache (override the location with TOUR_GRAPH_CACHE)
+GRAPH_CACHE_DIR = os.environ.get(
+    'TOUR_GRAPH_CACHE',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'graphs'))
+GRAPH_CACHE_VERSION = 1
+GRAPH_CACHE_MAX_AGE_DAYS = 30
+
+# places snapping further than this from the main road component are not routable
+MAX_SNAP_KM = 1.0
+
+# ALT landmarks precomputed (and cached) with each routing graph, 0 = great-circle A* only
+ROUTE_LANDMARKS = int(os.environ.get('TOUR_ROUTE_LANDMARKS', '8'))
 
 # cache
 WALKING_GRAPH = None
 DRIVING_GRAPH = None
 
-def load_graph():
-    global WALKING_GRAPH, DRIVING_GRAPH
+# array-backed routing graphs (core.road_graph.RoadGraph), per network type
+ROAD_GRAPHS = {}
 
-    if WALKING_GRAPH is None:
-        print("Loading walking network from OSM...")
-        WALKING_GRAPH = ox.graph_from_place("Metro Vancouver, British Columbia, Canada", network_type='walk')
-        print("Walking network loading completed!\n")
+# memoized (lat, lon) -> node index assignments, per network type
+_SNAP_CACHE = {'walk': {}, 'drive': {}}
 
-    if DRIVING_GRAPH is None:
-        print("Loading driving network from OSM...")
-        DRIVING_GRAPH = ox.graph_from_place("Metro Vancouver, British Columbia, Canada", network_type='drive')
-        print("Driving network loading completed!\n")
-        
-def walking_route_distance(start_lat, start_lon, end_lat, end_lon):
-    global WALKING_GRAPH
-    G = WALKING_GRAPH
+# routed distances in meters, keyed by (network type, source OSM id, target OSM id);
+# set TOUR_ROUTE_CACHE to a file path to keep them between runs
+ROUTE_CACHE_SIZE = 100_000
+ROUTE_CACHE_FILE = os.environ.get('TOUR_ROUTE_CACHE')
+ROUTE_CACHE = rc.RouteCache(ROUTE_CACHE_SIZE)
+
+# lazy loading state, per network type
+_GRAPH_LOCKS = {'walk': threading.Lock(), 'drive': threading.Lock()}
+_GRAPH_STATUS = {
+    'walk': {'state': 'not loaded', 'started': None, 'finished': None, 'error': None},
+    'drive': {'state': 'not loaded', 'started': None, 'finished': None, 'error': None},
+}
+_GRAPH_NAMES = {'walk': 'walking', 'drive': 'driving'}
+
+def graph_cache_paths(place, network_type, cache_dir=None):
+    """
+    (graph file, metadata file) for the given place and network type
+    """
+    cache_dir = cache_dir or GRAPH_CACHE_DIR
+    slug = re.sub(r'[^a-z0-9]+', '-', place.lower()).strip('-')
+    digest = hashlib.sha1(place.encode('utf-8')).hexdigest()[:8]
+    base = os.path.join(cache_dir, f"{slug}-{digest}-{network_type}")
+    return base + '.pkl', base + '.json'
+
+def save_graph_cache(G, place, network_type, cache_dir=None):
+    """
+    Write the graph as a pickle next to a JSON metadata file.
+    Files are written to a temp name first, so readers never see half a file.
+    """
+    # osmnx (and geopandas / shapely with it) is only loaded to download or save a graph
+    import osmnx as ox
+
+    graph_path, meta_path = graph_cache_paths(place, network_type, cache_dir)
+    os.makedirs(os.path.dirname(graph_path), exist_ok=True)
+
+    payload = pickle.dumps(G, protocol=pickle.HIGHEST_PROTOCOL)
+    meta = {
+        'version': GRAPH_CACHE_VERSION,
+        'place': place,
+        'network_type': network_type,
+        'osmnx': ox.__version__,
+        'created': time.time(),
+        'nodes': G.number_of_nodes(),
+        'edges': G.number_of_edges(),
+        'size': len(payload),
+        'sha256': hashlib.sha256(payload).hexdigest(),
+    }
 
+    with open(graph_path + '.tmp', 'wb') as f:
+        f.write(payload)
+    os.replace(graph_path + '.tmp', graph_path)
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+
+def load_graph_cache(place, network_type, cache_dir=None, max_age_days=GRAPH_CACHE_MAX_AGE_DAYS):
+    """
+    Load a cached graph
+        @param max_age_days: entries older than this are stale (None = never stale)
+        @return (graph, stale) or (None, False) if there is no valid entry
+    """
+    graph_path, meta_path = graph_cache_paths(place, network_type, cache_dir)
     try:
-        start_node = ox.distance.nearest_nodes(G, X=start_lon, Y=start_lat)
-        end_node = ox.distance.nearest_nodes(G, X=end_lon, Y=end_lat)
-        route = nx.shortest_path(G, start_node, end_node, weight='length')
-        length = nx.shortest_path_length(G, start_node, end_node, weight='length')
-        return length / 1000, route
-    except Exception as e:
-        # print(f"Walking path error: {e}")
-        return None, None
-    
-def driving_route_distance(start_lat, start_lon, end_lat, end_lon):
-    global DRIVING_GRAPH
-    G = DRIVING_GRAPH
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(graph_path, 'rb') as f:
+            payload = f.read()
+    except (OSError, ValueError):
+        return None, False
+
+    # invalid entries (format change, other key, truncated / corrupt file) are ignored
+    if (meta.get('version') != GRAPH_CACHE_VERSION or meta.get('place') != place
+            or meta.get('network_type') != network_type or meta.get('size') != len(payload)
+            or meta.get('sha256') != hashlib.sha256(payload).hexdigest()):
+        return None, False
+
+    stale = max_age_days is not None and time.time() - meta['created'] > max_age_days * 86400
+    return pickle.loads(payload), stale
+
+def clear_graph_cache(place=PLACE, network_type=None, cache_dir=None):
+    """
+    Remove cached graph(s) for the place, all network types if network_type is None
+    """
+    for nt in ([network_type] if network_type else ['walk', 'drive']):
+        for path in graph_cache_paths(place, nt, cache_dir):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(road_graph_cache_path(place, nt, cache_dir), ignore_errors=True)
+
+def road_graph_cache_path(place, network_type, cache_dir=None):
+    """
+    Directory of the array-backed routing graph (see RoadGraph.save) for the place / network
+    """
+    graph_path, _ = graph_cache_paths(place, network_type, cache_dir)
+    return graph_path[:-len('.pkl')] + '.csr'
+
+def _load_road_graph_cache(place, network_type, cache_dir=None, offline=False):
+    """
+    Memory-map the cached routing graph if it was built from the current graph cache entry
+    (same checksum) with the current ROUTE_LANDMARKS, and that entry is fresh (or we are
+    offline). None otherwise.
+    """
+    _, meta_path = graph_cache_paths(place, network_type, cache_dir)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    offline = offline or os.environ.get('TOUR_GRAPH_OFFLINE') == '1'
+    stale = time.time() - meta.get('created', 0) > GRAPH_CACHE_MAX_AGE_DAYS * 86400
+    if stale and not offline:
+        return None
+
+    path = road_graph_cache_path(place, network_type, cache_dir)
+    road_meta = rg.RoadGraph.read_meta(path)
+    if road_meta is None or road_meta.get('source') != meta.get('sha256'):
+        return None
+    if road_meta.get('landmarks') != ROUTE_LANDMARKS:
+        return None
+    try:
+        return rg.RoadGraph.load(path, mmap=True)
+    except (OSError, ValueError):
+        return None
+
+def _save_road_graph_cache(R, place, network_type, cache_dir=None):
+    _, meta_path = graph_cache_paths(place, network_type, cache_dir)
+    with open(meta_path) as f:
+        source = json.load(f)['sha256']
+    R.save(road_graph_cache_path(place, network_type, cache_dir), source=source, landmarks=ROUTE_LANDMARKS)
+
+def fetch_graph(place, network_type, cache_dir=None, refresh=False, offline=False):
+    """
+    Get a graph from the local cache, downloading it from OSM when missing or stale.
+    A stale entry is still used when the download fails (e.g. no network).
+        @param refresh: ignore the cache and download again
+        @param offline: never download (also set with TOUR_GRAPH_OFFLINE=1)
+    """
+    offline = offline or os.environ.get('TOUR_GRAPH_OFFLINE') == '1'
+    G, stale = (None, False) if refresh else load_graph_cache(place, network_type, cache_dir)
+    if G is not None and (not stale or offline):
+        return G
+
+    if offline:
+        raise FileNotFoundError(f"No cached {network_type} graph for '{place}' in {cache_dir or GRAPH_CACHE_DIR}")
+
+    import osmnx as ox
 
     try:
-        start_node = ox.distance.nearest_nodes(G, X=start_lon, Y=start_lat)
-        end_node = ox.distance.nearest_nodes(G, X=end_lon, Y=end_lat)
-        route = nx.shortest_path(G, start_node, end_node, weight='length')
-        length = nx.shortest_path_length(G, start_node, end_node, weight='length')
-        return length / 1000, route
-    except Exception as e:
-        # print(f"Driving path error: {e}")
+        fresh = ox.graph_from_place(place, network_type=network_type)
+    except Exception:
+        if G is None:
+            raise
+        print(f"Could not refresh the {network_type} network, using the cached copy")
+        return G
+
+    save_graph_cache(fresh, place, network_type, cache_dir)
+    return fresh
+
+def _loaded_graph(network_type):
+    return WALKING_GRAPH if network_type == 'walk' else DRIVING_GRAPH
+
+def get_graph(network_type, place=PLACE, cache_dir=None, refresh=False, offline=False, verbose=True):
+    """
+    Return the walking ('walk') or driving ('drive') graph, loading it on first use.
+    Thread safe: concurrent callers wait for the same load instead of repeating it.
+    """
+    global WALKING_GRAPH, DRIVING_GRAPH
+
+    G = _loaded_graph(network_type)
+    if G is not None:
+        return G
+
+    with _GRAPH_LOCKS[network_type]:
+        G = _loaded_graph(network_type)
+        if G is not None:
+            return G
+
+        status = _GRAPH_STATUS[network_type]
+        status.update(state='loading', started=time.time(), finished=None, error=None)
+        if verbose:
+            print(f"Loading {_GRAPH_NAMES[network_type]} network... (this may take a while)")
+        try:
+            G = fetch_graph(place, network_type, cache_dir, refresh, offline)
+        except Exception as e:
+            status.update(state='error', finished=time.time(), error=e)
+            raise
+
+        if network_type == 'walk':
+            WALKING_GRAPH = G
+        else:
+            DRIVING_GRAPH = G
+        status.update(state='ready', finished=time.time())
+        if verbose:
+            print(f"{_GRAPH_NAMES[network_type].capitalize()} network loading completed!\n")
+        return G
+
+def get_road_graph(network_type, place=PLACE, cache_dir=None, refresh=False, offline=False, verbose=True):
+    """
+    Return the array-backed routing graph of the network, building it on first use.
+    The networkx graph is only used for the conversion and is not kept around
+    (unless it was already loaded with get_graph).
+    The arrays are cached next to the graph cache and memory-mapped read-only, so
+    planner processes running on the same machine share one copy of the graph.
+    """
+    R = ROAD_GRAPHS.get(network_type)
+    if R is not None:
+        return R
+
+    with _GRAPH_LOCKS[network_type]:
+        R = ROAD_GRAPHS.get(network_type)
+        if R is not None:
+            return R
+
+        status = _GRAPH_STATUS[network_type]
+        status.update(state='loading', started=time.time(), finished=None, error=None)
+        if verbose:
+            print(f"Loading {_GRAPH_NAMES[network_type]} network... (this may take a while)")
+        try:
+            # fast path: memory-map the arrays saved by an earlier run / another process
+            R = None if refresh else _load_road_graph_cache(place, network_type, cache_dir, offline)
+            if R is None:
+                # the graph loaded with get_graph came from the same cache entry (fetch_graph)
+                G = None if refresh else _loaded_graph(network_type)
+                if G is None:
+                    G = fetch_graph(place, network_type, cache_dir, refresh, offline)
+                R = rg.RoadGraph.from_networkx(G).build_reverse().build_components()
+                if ROUTE_LANDMARKS:
+                    R.build_landmarks(ROUTE_LANDMARKS)
+                _save_road_graph_cache(R, place, network_type, cache_dir)
+                # reopen as a read-only memory map so the pages are shared between processes
+                R = rg.RoadGraph.load(road_graph_cache_path(place, network_type, cache_dir), mmap=True)
+        except Exception as e:
+            status.update(state='error', finished=time.time(), error=e)
+            raise
+
+        ROAD_GRAPHS[network_type] = R
+        _SNAP_CACHE[network_type] = {}
+        if ROUTE_CACHE_FILE:
+            ROUTE_CACHE.load(ROUTE_CACHE_FILE, {network_type: R.signature})
+        status.update(state='ready', finished=time.time())
+        if verbose:
+            print(f"{_GRAPH_NAMES[network_type].capitalize()} network loading completed!\n")
+        return R
+
+def attach_road_graph(network_type, path):
+    """
+    Use the routing graph saved with RoadGraph.save in the directory path
+    (e.g. exported once to /dev/shm) as a read-only, zero-copy memory map
+    """
+    with _GRAPH_LOCKS[network_type]:
+        R = rg.RoadGraph.load(path, mmap=True)
+        ROAD_GRAPHS[network_type] = R
+        _SNAP_CACHE[network_type] = {}
+        _GRAPH_STATUS[network_type].update(state='ready', started=time.time(), finished=time.time(), error=None)
+        return R
+
+def get_walking_graph():
+    return get_graph('walk')
+
+def get_driving_graph():
+    return get_graph('drive')
+
+def graph_status():
+    """
+    Readiness of each graph:
+        {'walk': {'state': 'not loaded' | 'loading' | 'ready' | 'error', 'seconds': ..., 'error': ...}, ...}
+    'seconds' is the load time so far (or in total once finished).
+    """
+    report = {}
+    for network_type, status in _GRAPH_STATUS.items():
+        seconds = None
+        if status['started'] is not None:
+            seconds = (status['finished'] or time.time()) - status['started']
+        report[network_type] = {'state': status['state'], 'seconds': seconds, 'error': status['error']}
+    return report
+
+def graph_ready(network_type):
+    """
+    True once the routing graph of the network is available
+    """
+    return network_type in ROAD_GRAPHS
+
+def preload_graphs(network_types=('walk', 'drive'), **kwargs):
+    """
+    Start loading the given graphs on a background worker thread.
+    Errors are kept in graph_status(); the next get_road_graph call retries.
+        @return the started thread
+    """
+    def worker():
+        for network_type in network_types:
+            try:
+                get_road_graph(network_type, verbose=False, **kwargs)
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=worker, name='graph-preload', daemon=True)
+    thread.start()
+    return thread
+
+def load_graph(place=PLACE, cache_dir=None, refresh=False, offline=False):
+    """
+    Load both routing graphs now (blocking)
+    """
+    get_road_graph('walk', place, cache_dir, refresh, offline)
+    get_road_graph('drive', place, cache_dir, refresh, offline)
+
+def snap_points(network_type, lats, lons):
+    """
+    Nearest main-component node of every point.
+    Assignments are memoized per network, so each point is only snapped once;
+    the points not seen yet are snapped together in one vectorized query.
+        @return list of node indices aligned with lats / lons
+    """
+    R = get_road_graph(network_type)
+    cache = _SNAP_CACHE[network_type]
+
+    keys = [(float(lat), float(lon)) for lat, lon in zip(lats, lons)]
+    missing = list(dict.fromkeys(key for key in keys if key not in cache))
+    if missing:
+        # snap into the main strongly connected component, so points never land on
+        # small islands (private roads, one-way dead ends) that no route can leave
+        nodes = R.nearest_nodes([key[0] for key in missing], [key[1] for key in missing], main_component=True)
+        cache.update(zip(missing, nodes.tolist()))
+
+    return [cache[key] for key in keys]
+
+def filter_routable(network_type, places, max_snap_km=MAX_SNAP_KM):
+    """
+    Keep the places within max_snap_km of the main road component
+    (drops e.g. places on islands that are only reachable by ferry)
+    """
+    R = get_road_graph(network_type)
+    _, meters = R.nearest_nodes(places['lat'].to_numpy(), places['lon'].to_numpy(),
+                                main_component=True, return_distance=True)
+    return places[meters <= max_snap_km * 1000]
+
+def snap_frame(network_type, data):
+    """
+    Snap (and memoize) every row of an amenity frame, e.g. all interesting places
+    """
+    return snap_points(network_type, data['lat'].to_numpy(), data['lon'].to_numpy())
+
+def save_route_cache(path=None):
+    """
+    Save the routed distances of the loaded networks (to TOUR_ROUTE_CACHE by default)
+        @return True if saved
+    """
+    path = path or ROUTE_CACHE_FILE
+    if not path or not ROAD_GRAPHS:
+        return False
+    ROUTE_CACHE.save(path, {network_type: R.signature for network_type, R in ROAD_GRAPHS.items()})
+    return True
+
+def route_cache_stats():
+    return ROUTE_CACHE.stats()
+
+def _route_lengths(network_type, source, targets):
+    """
+    Route lengths in meters from source to each target (node indices), inf if no route.
+    Served from ROUTE_CACHE when possible; the missing targets share one search.
+    """
+    R = get_road_graph(network_type)
+    source_id = int(R.node_ids[source])
+    keys = [(network_type, source_id, int(R.node_ids[target])) for target in targets]
+    lengths = [ROUTE_CACHE.get(key) for key in keys]
+
+    missing = [target for target, length in zip(targets, lengths) if length is None]
+    if len(missing) == 1:
+        # single pair: the goal-directed search settles far fewer nodes
+        length, _ = R.shortest_path_bidirectional(source, missing[0])
+        computed = {missing[0]: np.inf if length is None else length}
+    elif missing:
+        computed = dict(zip(missing, R.distances_to(source, missing).tolist()))
+    for i, (target, key) in enumerate(zip(targets, keys)):
+        if lengths[i] is None:
+            lengths[i] = computed[target]
+            ROUTE_CACHE.put(key, lengths[i])
+
+    return np.array(lengths, dtype=np.float64)
+
+def route_distance(network_type, start_lat, start_lon, end_lat, end_lon):
+    """
+    Shortest route on the network between the nodes nearest to start and end
+        @return (length in km, list of OSM node ids) or (None, None) if there is no route
+    """
+    R = get_road_graph(network_type)
+
+    start_node, end_node = snap_points(network_type, [start_lat, end_lat], [start_lon, end_lon])
+    length, path = R.shortest_path_bidirectional(start_node, end_node)
+    key = (network_type, int(R.node_ids[start_node]), int(R.node_ids[end_node]))
+    ROUTE_CACHE.put(key, np.inf if length is None else length)
+    if length is None:
         return None, None
+    return length / 1000, R.route_ids(path)
+
+def walking_route_distance(start_lat, start_lon, end_lat, end_lon):
+    return route_distance('walk', start_lat, start_lon, end_lat, end_lon)
+
+def driving_route_distance(start_lat, start_lon, end_lat, end_lon):
+    return route_distance('drive', start_lat, start_lon, end_lat, end_lon)
 
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371  # Earth r in km
@@ -67,21 +458,103 @@ def remove_duplicate_amenities(places):
     """
     return places.drop_duplicates(subset='amenity', keep='first').reset_index(drop=True)
 
-def find_nearest_path(start_point, places):
-    visited = []
-    remaining = places.copy()
-    current = start_point
+# ==============================================================
+# Tour optimization over a precomputed distance matrix
+# ==============================================================
+
+# default time budget (seconds) for the 2-opt / Or-opt improvement
+TOUR_TIME_BUDGET = 1.0
+
+def distance_matrix(points, mode='straight'):
+    """
+    Full k x k distance matrix (km) between points
+        @param points: list of (lat, lon)
+        @param mode: 'straight' (haversine), 'walk' or 'drive' (routed, inf if no route)
+        D[i][j] is the distance from point i to point j (not symmetric when driving)
+    """
+    lats = np.array([p[0] for p in points], dtype=np.float64)
+    lons = np.array([p[1] for p in points], dtype=np.float64)
+
+    if mode == 'straight':
+        return haversine(lats[:, None], lons[:, None], lats[None, :], lons[None, :])
 
-    while not remaining.empty:
-        remaining['distance'] = remaining.apply(
-            lambda row: haversine(current[0], current[1], row['lat'], row['lon']),
-            axis=1
-        )
+    # one one-to-many search per row, cached in ROUTE_CACHE
+    nodes = snap_points(mode, lats, lons)
+    return np.array([_route_lengths(mode, node, nodes) for node in nodes]) / 1000
+
+def _path_cost(D, order):
+    return sum(D[a][b] for a, b in zip(order, order[1:]))
+
+def _greedy_order(D):
+    """
+    Nearest-neighbour open path from point 0; points without a finite leg are left out
+    """
+    order = [0]
+    left = list(range(1, len(D)))
+    while left:
+        best = min(left, key=lambda j: D[order[-1]][j])
+        if np.isinf(D[order[-1]][best]):
+            break
+        left.remove(best)
+        order.append(best)
+    return order
+
+def _improve_order(D, order, time_budget):
+    """
+    2-opt and Or-opt moves on an open path that starts at order[0], until no move
+    improves it or time_budget seconds have passed.
+    Costs are re-evaluated on the whole path, so asymmetric (driving) matrices work too.
+    """
+    deadline = time.time() + time_budget
+    best_cost = _path_cost(D, order)
+    n = len(order)
+
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+
+        # 2-opt: reverse order[i:j + 1]
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                cost = _path_cost(D, candidate)
+                if cost < best_cost - 1e-9:
+                    order, best_cost, improved = candidate, cost, True
+
+        # Or-opt: move a segment of 1 to 3 stops somewhere else
+        for length in (1, 2, 3):
+            for i in range(1, n - length + 1):
+                segment = order[i:i + length]
+                rest = order[:i] + order[i + length:]
+                for k in range(1, len(rest) + 1):
+                    if k == i:
+                        continue
+                    candidate = rest[:k] + segment + rest[k:]
+                    cost = _path_cost(D, candidate)
+                    if cost < best_cost - 1e-9:
+                        order, best_cost, improved = candidate, cost, True
+                        break
+
+            if time.time() >= deadline:
+                break
+
+    return order
+
+def optimize_tour(start_point, places, mode='straight', time_budget=TOUR_TIME_BUDGET):
+    """
+    Tour through places starting at start_point: greedy nearest-neighbour on the
+    distance matrix, then improved with 2-opt / Or-opt within time_budget seconds.
+    Places that cannot be reached are left out.
+        @param mode: 'straight', 'walk' or 'drive'
+        @return (route, legs, total): rows (pandas Series) in visiting order,
+            km of each leg (from the previous stop) and total km
+    """
+    places = places.reset_index(drop=True)
+    points = [tuple(start_point)] + list(zip(places['lat'], places['lon']))
+    D = distance_matrix(points, mode)
 
-        nearest = remaining.sort_values(by='distance').iloc[0]
-        visited.append(nearest)
-        
-        current = (nearest['lat'], nearest['lon'])
-        remaining = remaining.drop(nearest.name)
+    order = _improve_order(D, _greedy_order(D), time_budget)
 
-    return visited
+    route = [places.iloc[i - 1] for i in order[1:]]
+    legs = [float(D[a][b]) for a, b in zip(order, order[1:])]
+    return route, legs, sum(legs)
@@ -9,6 +9,9 @@ from core import interesting_place as ip
 from core import find_place as fp
 from core import photos_to_gpx as pg
 from core import food_area as fa
+from core import amenity_store as st
+from core import dataset as ds
+from core import map_batch as mb
 
 def get_valid_input(input_value, min_option, max_option):
     try:
@@ -46,38 +49,23 @@ def get_photo_csv_to_df():
         print(f"Error: File '{input_file}' not found!")
         return None
 
-def find_nearest_walking_path(start_point, places_df):
-    remaining = places_df.copy().reset_index(drop=True)
-    path = []
-    current = start_point
-
-    while not remaining.empty:
-        distances = []
-        for i, row in remaining.iterrows():
-            dist, success = tro.walking_route_distance(current[0], current[1], row['lat'], row['lon'])
-            if success:
-                distances.append((i, dist))
-        
-        if not distances:
-            break 
-
-        nearest_idx, nearest_dist = min(distances, key=lambda x: x[1])
-        nearest_place = remaining.iloc[nearest_idx]
-        path.append(nearest_place)
-        current = (nearest_place['lat'], nearest_place['lon'])
-        remaining = remaining.drop(remaining.index[nearest_idx]).reset_index(drop=True)
-
-    return path
-
 def main():
 
     # read data
     file = sys.argv[1]
-    data = dc.basic_clean_data(pd.read_json(file, lines=True, compression='gzip'))
+    data, tags = st.load_amenities(file)
+    # score once, options 1, 2, 6, 7 and 8 reuse it
+    data = ip.add_hidden_score(data)
+    # category partitions and views shared by every option
+    data = ds.Dataset(data, tags)
+    ranking = ip.build_theme_ranking(data)
+    # shared by the nearby searches (options 3 and 4)
+    index = data.spatial_index
      
-    # load OSM
-    print("Loading OSM data... (this may take a while)")
-    tro.load_graph()
+    # road networks load on first use (options 7 and 8),
+    # --preload-graphs starts loading them in the background right away
+    if '--preload-graphs' in sys.argv[2:]:
+        tro.preload_graphs()
 
     print("Ready to explore? Choose an option below!")
 
@@ -98,14 +86,17 @@ def main():
         print("     9. Get the map for all food place in Vancouver")
         print("     10. Show unique type that in tha data")
         print("     11. Get the map for a type in Vancouver")
+        print("     12. Get the map of the food hotspots in Vancouver")
+        print("     13. Find hidden gems near a photo")
         print("\n============================================================\n")
 
         # get input
         option = input("Enter the option number: ")
-        option = get_valid_input(option, 0, 11)
+        option = get_valid_input(option, 0, 13)
 
         if option == 0:
             print("Exiting...")
+            tro.save_route_cache()
             break
         
         elif option == 1:
@@ -122,14 +113,14 @@ def main():
                 print("What theme do you want to find hidden gems for? (type list if want to see the list of themes)")
                 input_val = input("Enter the theme: ").strip().lower()
                 if (input_val == "list"):
-                    ip.show_theme()
+                    ip.show_theme(ranking)
                     continue
                 
                 print("How many hidden gems do you want to find?")
                 input_val2 = input("Enter the number of hidden gems(1 to 10): ")
                 input_val2 = get_valid_input(input_val2, 1, 10)
                 if not input_val2 == -1:
-                    ip.show_interesting_places(data, input_val2, 2, input_val)
+                    ip.show_interesting_places(data, input_val2, 2, input_val, ranking)
                     break
                 else:
                     break
@@ -151,7 +142,7 @@ def main():
                     print("Back to main")
                     break
                 elif (photo_idx > 0):
-                    near_places = fp.find_near_amenities(photos.iloc[photo_idx - 1], data)
+                    near_places = fp.find_near_amenities(photos.iloc[photo_idx - 1], data, index)
                     near_places_save = pd.DataFrame([{
                         'Name': place['name'], 'Amenity': place['amenity'], 'Distance(km)': f'{distance:.2f}'
                     } for place, distance in near_places])
@@ -188,7 +179,7 @@ def main():
                 if(max_distance_km == -1):
                     continue
                 if (photo_idx > 0):
-                    near_food = fp.find_near_food(photos.iloc[photo_idx - 1], data, max_distance_km)
+                    near_food = fp.find_near_food(photos.iloc[photo_idx - 1], data, max_distance_km, index)
 
                     near_food_save = pd.DataFrame([{
                         'Name': place['name'], 'Amenity': place['amenity'], 'Distance(km)': f'{distance:.2f}'
@@ -240,24 +231,24 @@ def main():
             if num == -1:
                 continue
 
-            filtered_places = dc.get_interesting_places(data)
-            hidden_places = ip.find_n_hidden_gems(filtered_places, n=(num*3))
+            # best gems near the start point (score minus a penalty per km), not the global top
+            radius_km, distance_weight = ip.NEAR_GEMS_SEARCH['straight']
+            hidden_places = ip.find_hidden_gems_near(data, start_point[0], start_point[1], num * 3,
+                                                     radius_km, distance_weight, index)
+            if hidden_places.empty:
+                print(f"No interesting places within {radius_km} km of the photo")
+                continue
 
             # No dup themes!
             unique_theme_places = tro.remove_duplicate_amenities(hidden_places).head(num)
-            route = tro.find_nearest_path(start_point, unique_theme_places)
+            route, legs, total_dist = tro.optimize_tour(start_point, unique_theme_places, 'straight')
             
-            current = start_point
-            total_dist = 0.0
             # Note that the distance is straight line distance, not the actual walking distance
             print("\nRecommended Tour Path:")
             
-            for i, place in enumerate(route, 1):
-                dist = tro.haversine(current[0], current[1], place['lat'], place['lon'])
+            for i, (place, dist) in enumerate(zip(route, legs), 1):
                 start_dist = tro.haversine(start_point[0], start_point[1], place['lat'], place['lon'])
-                total_dist += dist
                 print(f"{i}. {place['name']} ({place['amenity']}) +{dist:.2f} km (from start: {start_dist:.2f} km)")
-                current = (place['lat'], place['lon'])
             print(f"\nTotal Distance: {total_dist:.2f} km\n\n")
             
         elif option == 7:
@@ -265,29 +256,6 @@ def main():
             if photos is None:
                 continue
             
-            def find_nearest_walking_path(start_point, places_df):
-                remaining = places_df.copy().reset_index(drop=True)
-                path = []
-                current = start_point
-
-                while not remaining.empty:
-                    distances = []
-                    for i, row in remaining.iterrows():
-                        dist, _ = tro.walking_route_distance(current[0], current[1], row['lat'], row['lon'])
-                        if dist is not None:
-                            distances.append((i, dist))
-                    
-                    if not distances:
-                        break
-
-                    nearest_idx, nearest_dist = min(distances, key=lambda x: x[1])
-                    nearest_place = remaining.iloc[nearest_idx]
-                    path.append(nearest_place)
-                    current = (nearest_place['lat'], nearest_place['lon'])
-                    remaining = remaining.drop(index=nearest_idx).reset_index(drop=True)
-
-                return path
-
             print("\nAvailable photos:")
             for idx, row in photos.iterrows():
                 print(f"    {idx+1}. {row['timestamp']} (Lat: {row['latitude']}, Lon: {row['longitude']})")
@@ -304,23 +272,31 @@ def main():
             if num == -1:
                 continue
 
-            filtered_places = dc.get_interesting_places(data)
-            hidden_places = ip.find_n_hidden_gems(filtered_places, n=(num * 3))
-            unique_theme_places = tro.remove_duplicate_amenities(hidden_places).head(num)
+            try:
+                tro.get_road_graph('walk')
+                # snap every interesting place once, later tours reuse the assignment
+                tro.snap_frame('walk', data.interesting_places())
+            except Exception as e:
+                print(f"Could not load the walking network: {e}")
+                continue
 
-            route = find_nearest_walking_path(start_point, unique_theme_places)
+            # best gems near the start point (score minus a penalty per km), not the global top
+            radius_km, distance_weight = ip.NEAR_GEMS_SEARCH['walk']
+            hidden_places = ip.find_hidden_gems_near(data, start_point[0], start_point[1], num * 3,
+                                                     radius_km, distance_weight, index)
+            hidden_places = tro.filter_routable('walk', hidden_places)
+            if hidden_places.empty:
+                print(f"No interesting places within {radius_km} km of the photo")
+                continue
+            unique_theme_places = tro.remove_duplicate_amenities(hidden_places).head(num)
 
-            current = start_point
-            total_dist = 0.0
-            cumulative_dist = 0.0 
+            route, legs, total_dist = tro.optimize_tour(start_point, unique_theme_places, 'walk')
+            cumulative_dist = 0.0
 
             print("\nRecommended Walking Tour Path:")
-            for i, place in enumerate(route, 1):
-                dist, _ = tro.walking_route_distance(current[0], current[1], place['lat'], place['lon'])
+            for i, (place, dist) in enumerate(zip(route, legs), 1):
                 cumulative_dist += dist
-                total_dist += dist
                 print(f"{i}. {place['name']} ({place['amenity']}) +{dist:.2f} km (from start: {cumulative_dist:.2f} km)")
-                current = (place['lat'], place['lon'])
 
             print(f"\nTotal Walking Distance: {total_dist:.2f} km\n")
             
@@ -329,29 +305,6 @@ def main():
             if photos is None:
                 continue
             
-            def find_nearest_driving_path(start_point, places_df):
-                remaining = places_df.copy().reset_index(drop=True)
-                path = []
-                current = start_point
-
-                while not remaining.empty:
-                    distances = []
-                    for i, row in remaining.iterrows():
-                        dist, _ = tro.driving_route_distance(current[0], current[1], row['lat'], row['lon'])
-                        if dist is not None:
-                            distances.append((i, dist))
-
-                    if not distances:
-                        break
-
-                    nearest_idx, nearest_dist = min(distances, key=lambda x: x[1])
-                    nearest_place = remaining.iloc[nearest_idx]
-                    path.append(nearest_place)
-                    current = (nearest_place['lat'], nearest_place['lon'])
-                    remaining = remaining.drop(index=nearest_idx).reset_index(drop=True)
-
-                return path
-
             print("\nAvailable photos:")
             for idx, row in photos.iterrows():
                 print(f"    {idx+1}. {row['timestamp']} (Lat: {row['latitude']}, Lon: {row['longitude']})")
@@ -368,23 +321,31 @@ def main():
             if num == -1:
                 continue
 
-            filtered_places = dc.get_interesting_places(data)
-            hidden_places = ip.find_n_hidden_gems(filtered_places, n=(num * 3))
-            unique_theme_places = tro.remove_duplicate_amenities(hidden_places).head(num)
+            try:
+                tro.get_road_graph('drive')
+                # snap every interesting place once, later tours reuse the assignment
+                tro.snap_frame('drive', data.interesting_places())
+            except Exception as e:
+                print(f"Could not load the driving network: {e}")
+                continue
 
-            route = find_nearest_driving_path(start_point, unique_theme_places)
+            # best gems near the start point (score minus a penalty per km), not the global top
+            radius_km, distance_weight = ip.NEAR_GEMS_SEARCH['drive']
+            hidden_places = ip.find_hidden_gems_near(data, start_point[0], start_point[1], num * 3,
+                                                     radius_km, distance_weight, index)
+            hidden_places = tro.filter_routable('drive', hidden_places)
+            if hidden_places.empty:
+                print(f"No interesting places within {radius_km} km of the photo")
+                continue
+            unique_theme_places = tro.remove_duplicate_amenities(hidden_places).head(num)
 
-            current = start_point
-            total_dist = 0.0
+            route, legs, total_dist = tro.optimize_tour(start_point, unique_theme_places, 'drive')
             cumulative_dist = 0.0
 
             print("\nRecommended Driving Tour Path:")
-            for i, place in enumerate(route, 1):
-                dist, _ = tro.driving_route_distance(current[0], current[1], place['lat'], place['lon'])
+            for i, (place, dist) in enumerate(zip(route, legs), 1):
                 cumulative_dist += dist
-                total_dist += dist
                 print(f"{i}. {place['name']} ({place['amenity']}) +{dist:.2f} km (from start: {cumulative_dist:.2f} km)")
-                current = (place['lat'], place['lon'])
 
             print(f"\nTotal Driving Distance: {total_dist:.2f} km\n")
 
@@ -399,25 +360,68 @@ def main():
             print("unique.csv is create in file")
         
         elif option == 11:
+            # the types are known from the category partitions, no need to list them again per map
+            unique = data.amenity_types()
             while(True):
                 print("0. Exit")
                 print("1. Get the type map")
+                print("2. Get the maps of every type (only the changed types are rendered again)")
                 option = input("Enter the option number: ")
-                option = get_valid_input(option, 0, 1)
+                option = get_valid_input(option, 0, 2)
                 if option == 0:
                     print("Back to main")
                     break
                 elif option == 1:
                     amenity_type = input("Enter the type you want to find(from list of option 10): ")
-                    unique = fp.show_all_amenity_type(data)
                     amenity_type = get_valid_type(amenity_type, unique)
                     if amenity_type == -1:
                         continue
                     m = fp.make_map(data,amenity_type)
                     m.save(f'{amenity_type}_map.html')
                     print(f"{amenity_type}_map.html is create in file")
+                elif option == 2:
+                    result = mb.render_all(data)
+                    print(f"{len(result['rendered'])} maps rendered, {len(result['skipped'])} unchanged, "
+                          f"{len(result['removed'])} removed in {mb.MAP_DIR}")
                 elif option == -1:
                     continue
+
+        elif option == 12:
+            hotspots = fa.food_hotspots(data)
+            print(f"\nTop food hotspots ({fa.DEFAULT_CELL_KM * 1000:.0f} m cells with at least {fa.DEFAULT_MIN_COUNT} food places):\n")
+            print(hotspots.drop(columns = ['geometry']).head(10).to_string(index = False))
+            m = fa.create_food_density_map(data)
+            m.save('food_hotspots_map.html')
+            print("food_hotspots_map.html is create in file")
+
+        elif option == 13:
+            photos = get_photo_csv_to_df()
+            if photos is None:
+                continue
+
+            print("\nAvailable photos:")
+            for idx, row in photos.iterrows():
+                print(f"    {idx+1}. {row['timestamp']} (Lat: {row['latitude']}, Lon: {row['longitude']})")
+            photo_idx = input("Select a photo number: ")
+            photo_idx = get_valid_input(photo_idx, 1, len(photos))
+            if photo_idx == -1:
+                continue
+
+            print("How many hidden gems do you want?")
+            num = input("Enter number(1 to 50): ")
+            num = get_valid_input(num, 1, 50)
+            if num == -1:
+                continue
+
+            photo = photos.iloc[photo_idx - 1]
+            radius_km, distance_weight = ip.NEAR_GEMS_SEARCH['straight']
+            gems = ip.find_hidden_gems_near(data, photo['latitude'], photo['longitude'], num,
+                                            radius_km, distance_weight, index)
+            if gems.empty:
+                print(f"No interesting places within {radius_km} km of the photo")
+                continue
+            print(f"\nTop {num} hidden gems within {radius_km} km (score - {distance_weight} per km):\n")
+            print(gems[['name', 'amenity', 'hidden_score', 'distance_km', 'gem_score']].round(2).to_string(index = False))
                 
 
 